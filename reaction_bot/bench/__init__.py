@@ -0,0 +1,8 @@
+"""
+Нагрузочный стенд: настоящий Dispatcher с all_routers и сервисами из main.py,
+а вместо Telegram — локальный фейковый Bot API.
+
+    python -m bench                      # все сценарии
+    python -m bench click_storm --updates 5000 --concurrency 200
+    python -m bench --json before.json   # сохранить результат для сравнения
+"""
@@ -0,0 +1,98 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+from dataclasses import replace
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+
+import runtime
+from bench.fake_api import FakeBotApi
+from bench.runner import BenchContext, DbTimer, format_result, run_scenario
+from bench.scenarios import SCENARIOS
+
+BENCH_CHAT_ID = -1001000000001
+BENCH_TOPIC_ID = 10
+BENCH_WELCOME_TOPIC_ID = 11
+
+
+def bench_config(db_path: str, card_edit_interval: float):
+    # остальные параметры — из окружения/.env, как у бота: так удобно сравнивать настройки
+    os.environ.setdefault("BOT_TOKEN", "123456:bench")
+    os.environ.setdefault("CHAT_ID", str(BENCH_CHAT_ID))
+    os.environ.setdefault("TOPIC_ID", str(BENCH_TOPIC_ID))
+    os.environ.setdefault("WELCOME_TOPIC_ID", str(BENCH_WELCOME_TOPIC_ID))
+    from config import load_config
+
+    return replace(
+        load_config(),
+        bot_token="123456:bench",
+        chat_id=BENCH_CHAT_ID,
+        topic_id=BENCH_TOPIC_ID,
+        welcome_topic_id=BENCH_WELCOME_TOPIC_ID,
+        db_path=db_path,
+        card_edit_interval=card_edit_interval,
+    )
+
+
+async def run(args) -> int:
+    from main import build_dispatcher, close_services, open_services
+
+    api = FakeBotApi(latency=args.api_latency_ms / 1000)
+    await api.start()
+
+    with tempfile.TemporaryDirectory(prefix="reaction-bench-") as tmp:
+        config = bench_config(os.path.join(tmp, "bench.db"), args.card_edit_interval)
+        bot = Bot(
+            token=config.bot_token,
+            session=runtime.make_session(config, api=TelegramAPIServer.from_base(api.base_url)),
+            default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+        )
+        data = await open_services(config, bot)
+        dp = build_dispatcher(data)
+
+        timer = DbTimer()
+        for db in data["chats"].databases():
+            timer.attach(db)
+        ctx = BenchContext(dp, bot, data, api, timer)
+
+        results = []
+        try:
+            for name in args.scenarios or list(SCENARIOS):
+                r = await run_scenario(ctx, name, SCENARIOS[name], args.updates, args.concurrency)
+                print(format_result(r), flush=True)
+                results.append(r.summary())
+        finally:
+            await close_services(data)
+            await bot.session.close()
+            await api.close()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m bench", description="нагрузочный стенд бота")
+    parser.add_argument("scenarios", nargs="*", choices=[[], *SCENARIOS], metavar="scenario",
+                        help="сценарии: " + ", ".join(SCENARIOS) + " (по умолчанию все)")
+    parser.add_argument("--updates", type=int, default=2000, help="апдейтов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=100, help="апдейтов в обработке одновременно")
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="задержка ответа фейкового Bot API")
+    parser.add_argument("--card-edit-interval", type=float, default=1.0)
+    parser.add_argument("--json", help="сохранить результаты в файл")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # профиль (RUNTIME_PROFILE=fast) — как у бота, из окружения
+    sys.exit(runtime.run(run(args), os.getenv("RUNTIME_PROFILE", "default")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import asyncio
+import itertools
+import time
+from collections import Counter
+
+from aiohttp import web
+
+
+class FakeBotApi:
+    """
+    Локальная замена api.telegram.org: отвечает правдоподобными объектами
+    и считает вызовы по методам. latency — искусственная задержка ответа, сек.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.calls: Counter[str] = Counter()
+
+        self._message_ids = itertools.count(1_000_000)
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # при port=0 порт выбирает система
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def reset(self) -> Counter[str]:
+        calls, self.calls = self.calls, Counter()
+        return calls
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({"ok": True, "result": self._result(method.lower(), params)})
+
+    def _result(self, method: str, params: dict):
+        if method in ("sendmessage", "editmessagetext"):
+            chat_id = int(params["chat_id"])
+            message_id = int(params.get("message_id") or next(self._message_ids))
+            msg = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup"},
+                "text": params.get("text", ""),
+            }
+            if params.get("message_thread_id"):
+                msg["message_thread_id"] = int(params["message_thread_id"])
+                msg["is_topic_message"] = True
+            return msg
+        if method == "getchatmember":
+            user_id = int(params["user_id"])
+            return {
+                "status": "member",
+                "user": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            }
+        if method == "getme":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        return True
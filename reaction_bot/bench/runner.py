@@ -0,0 +1,167 @@
+import asyncio
+import itertools
+import logging
+import statistics
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+
+from aiogram import Bot, Dispatcher
+
+from bench.updates import UpdateFactory
+from metrics import wrap_database
+from utils import parse_post_key
+
+log = logging.getLogger(__name__)
+
+
+class DbTimer:
+    """Время и число вызовов по методам Database за сценарий (обёртка из metrics)."""
+
+    def __init__(self):
+        self.calls: Counter[str] = Counter()
+        self.seconds: defaultdict[str, float] = defaultdict(float)
+
+    def attach(self, db):
+        wrap_database(db, self._observe)
+
+    def _observe(self, method: str, seconds: float):
+        self.calls[method] += 1
+        self.seconds[method] += seconds
+
+    def reset(self) -> tuple[Counter[str], dict[str, float]]:
+        calls, seconds = self.calls, dict(self.seconds)
+        self.calls, self.seconds = Counter(), defaultdict(float)
+        return calls, seconds
+
+
+@dataclass
+class Result:
+    scenario: str
+    updates: int
+    errors: int
+    wall: float
+    latencies: list[float] = field(repr=False)
+    db_calls: Counter[str]
+    db_seconds: dict[str, float]
+    api_calls: Counter[str]
+
+    def percentile(self, p: float) -> float:
+        if len(self.latencies) < 2:
+            return self.latencies[0] if self.latencies else 0.0
+        return statistics.quantiles(self.latencies, n=100, method="inclusive")[int(p) - 1]
+
+    def summary(self) -> dict:
+        n = max(1, self.updates)
+        return {
+            "scenario": self.scenario,
+            "updates": self.updates,
+            "errors": self.errors,
+            "updates_per_sec": round(self.updates / self.wall, 1) if self.wall else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 2),
+            "p99_ms": round(self.percentile(99) * 1000, 2),
+            "db_ms_per_update": round(sum(self.db_seconds.values()) * 1000 / n, 3),
+            "db_calls_per_update": round(sum(self.db_calls.values()) / n, 2),
+            "api_calls_per_update": round(sum(self.api_calls.values()) / n, 3),
+            "api_calls": dict(self.api_calls),
+            "db_calls": dict(self.db_calls),
+            "db_ms": {k: round(v * 1000, 2) for k, v in self.db_seconds.items()},
+        }
+
+
+class BenchContext:
+    """Что видят сценарии: фабрика апдейтов, свежие id участников и ссылок, подготовка данных."""
+
+    def __init__(self, dp: Dispatcher, bot: Bot, data: dict, api, timer: DbTimer):
+        self.dp = dp
+        self.bot = bot
+        self.data = data
+        self.api = api
+        self.timer = timer
+        self.config = data["config"]
+        self.updates = UpdateFactory(self.config.chat_id, self.config.topic_id, self.config.welcome_topic_id)
+
+        self._user_ids = itertools.count(10_000)
+        self._post_ids = itertools.count(1)
+
+    def new_users(self, count: int) -> list[int]:
+        return [next(self._user_ids) for _ in range(count)]
+
+    def new_link(self) -> tuple[str, str]:
+        url = f"https://t.me/bench_channel/{next(self._post_ids)}"
+        return url, parse_post_key(url)
+
+    async def prepare(self, updates: list[dict]):
+        for update in updates:
+            await self.dp.feed_raw_update(self.bot, update, **self.data)
+
+    async def task_cards(self, post_keys: list[str]) -> list[tuple[int, int]]:
+        db = self.data["chats"].db_for(self.config.chat_id)
+        tasks = await db.get_tasks_by_post_keys(self.config.chat_id, post_keys)
+        missing = [key for key in post_keys if key not in tasks]
+        if missing:
+            raise RuntimeError(f"tasks for {missing} were not created during preparation")
+        return [(tasks[key].id, tasks[key].card_message_id) for key in post_keys]
+
+    async def feed(self, updates: list[dict], concurrency: int) -> tuple[list[float], int]:
+        """Скармливает апдейты параллельно (как polling с handle_as_tasks), не больше concurrency разом."""
+        sem = asyncio.Semaphore(concurrency)
+        latencies: list[float] = []
+        errors = 0
+
+        async def one(update: dict):
+            nonlocal errors
+            async with sem:
+                started = time.perf_counter()
+                try:
+                    await self.dp.feed_raw_update(self.bot, update, **self.data)
+                except Exception:
+                    errors += 1
+                    if errors == 1:
+                        log.exception("update %s failed", update["update_id"])
+                latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(one(u) for u in updates))
+        return latencies, errors
+
+
+async def run_scenario(ctx: BenchContext, name: str, scenario, n: int, concurrency: int) -> Result:
+    updates = await scenario(ctx, n)
+    # отложенные правки карточек из подготовки не должны попасть в замер
+    await asyncio.sleep(ctx.config.card_edit_interval)
+    ctx.api.reset()
+    ctx.timer.reset()
+
+    started = time.perf_counter()
+    latencies, errors = await ctx.feed(updates, concurrency)
+    wall = time.perf_counter() - started
+
+    # правки карточек уходят с задержкой, их тоже считаем
+    await asyncio.sleep(ctx.config.card_edit_interval + 0.2)
+    db_calls, db_seconds = ctx.timer.reset()
+    return Result(
+        scenario=name,
+        updates=len(updates),
+        errors=errors,
+        wall=wall,
+        latencies=latencies,
+        db_calls=db_calls,
+        db_seconds=db_seconds,
+        api_calls=ctx.api.reset(),
+    )
+
+
+def format_result(r: Result) -> str:
+    s = r.summary()
+    lines = [
+        f"{r.scenario}: {s['updates']} updates, {s['updates_per_sec']} upd/s, "
+        f"p50 {s['p50_ms']} ms, p99 {s['p99_ms']} ms, errors {s['errors']}",
+        f"  db:  {s['db_ms_per_update']} ms/update, {s['db_calls_per_update']} calls/update",
+        f"  api: {s['api_calls_per_update']} calls/update  "
+        + " ".join(f"{k}={v}" for k, v in sorted(r.api_calls.items())),
+    ]
+    slowest = sorted(r.db_seconds.items(), key=lambda kv: kv[1], reverse=True)[:5]
+    for method, sec in slowest:
+        calls = r.db_calls[method]
+        lines.append(f"    {method:<32} {calls:>7} calls {sec * 1000 / calls:>8.3f} ms avg")
+    return "\n".join(lines)
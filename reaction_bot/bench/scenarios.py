@@ -0,0 +1,89 @@
+"""
+Сценарии нагрузки. Каждый получает контекст стенда и число апдейтов,
+при необходимости готовит данные через ctx.prepare(...) (это не меряется)
+и возвращает список апдейтов для замера.
+"""
+import random
+
+# столько ссылок один участник постит в подготовке — заведомо меньше недельного лимита
+LINKS_PER_USER = 5
+
+
+async def _make_tasks(ctx, count: int) -> list[tuple[int, int]]:
+    """Создаёт count заданий обычными постами; возвращает [(task_id, card_message_id)]."""
+    authors = ctx.new_users(count // LINKS_PER_USER + 1)
+    links = [ctx.new_link() for _ in range(count)]
+    await ctx.prepare([
+        ctx.updates.message(authors[i // LINKS_PER_USER], f"глянь {url}")
+        for i, (url, _) in enumerate(links)
+    ])
+    return await ctx.task_cards([post_key for _, post_key in links])
+
+
+async def link_posts(ctx, n: int) -> list[dict]:
+    """Поток постов со ссылками: создание заданий, в т.ч. упор в недельный лимит."""
+    users = ctx.new_users(n // (ctx.config.weekly_task_limit + 2) + 1)
+    out = []
+    for i in range(n):
+        url, _ = ctx.new_link()
+        out.append(ctx.updates.message(users[i % len(users)], f"новый пост {url}"))
+    return out
+
+
+async def click_storm(ctx, n: int) -> list[dict]:
+    """Все жмут «done» под одной карточкой; немного повторов и отмен."""
+    [(task_id, card)] = await _make_tasks(ctx, 1)
+    users = ctx.new_users(n)
+    rnd = random.Random(1)
+    clicked: list[int] = []
+    out = []
+    for user_id in users:
+        r = rnd.random()
+        if r < 0.1 and clicked:
+            out.append(ctx.updates.click(rnd.choice(clicked), f"done:{task_id}", card))
+        elif r < 0.2 and clicked:
+            out.append(ctx.updates.click(rnd.choice(clicked), f"undo:{task_id}", card))
+        else:
+            clicked.append(user_id)
+            out.append(ctx.updates.click(user_id, f"done:{task_id}", card))
+    return out
+
+
+async def many_users(ctx, n: int) -> list[dict]:
+    """Много участников отмечают много разных заданий."""
+    tasks = await _make_tasks(ctx, 50)
+    users = ctx.new_users(max(1, n // 5))
+    rnd = random.Random(2)
+    out = []
+    for _ in range(n):
+        task_id, card = rnd.choice(tasks)
+        action = "undo" if rnd.random() < 0.1 else "done"
+        out.append(ctx.updates.click(rnd.choice(users), f"{action}:{task_id}", card))
+    return out
+
+
+async def leaderboard_spam(ctx, n: int) -> list[dict]:
+    """Кнопки топов и «мой прогресс» при заполненной таблице лидеров."""
+    tasks = await _make_tasks(ctx, 20)
+    users = ctx.new_users(200)
+    rnd = random.Random(3)
+    await ctx.prepare([
+        ctx.updates.click(rnd.choice(users), f"done:{task_id}", card)
+        for task_id, card in (rnd.choice(tasks) for _ in range(1000))
+    ])
+    kinds = ["top", "top", "month_top", "me"]
+    return [ctx.updates.click(rnd.choice(users), rnd.choice(kinds)) for _ in range(n)]
+
+
+async def join_burst(ctx, n: int) -> list[dict]:
+    """Массовый вход участников в группу."""
+    return [ctx.updates.join(user_id) for user_id in ctx.new_users(n)]
+
+
+SCENARIOS = {
+    "link_posts": link_posts,
+    "click_storm": click_storm,
+    "many_users": many_users,
+    "leaderboard_spam": leaderboard_spam,
+    "join_burst": join_burst,
+}
@@ -0,0 +1,66 @@
+import itertools
+import time
+
+
+class UpdateFactory:
+    """Сырые апдейты (dict в формате Bot API) для одного чата с темами."""
+
+    def __init__(self, chat_id: int, topic_id: int, welcome_topic_id: int):
+        self.chat_id = chat_id
+        self.topic_id = topic_id
+        self.welcome_topic_id = welcome_topic_id
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+    def _chat(self) -> dict:
+        return {"id": self.chat_id, "type": "supergroup", "title": "bench"}
+
+    def message(self, user_id: int, text: str) -> dict:
+        update_id = next(self._ids)
+        return {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": self._chat(),
+                "from": self._user(user_id),
+                "message_thread_id": self.topic_id,
+                "is_topic_message": True,
+                "text": text,
+            },
+        }
+
+    def click(self, user_id: int, data: str, card_message_id: int = 1) -> dict:
+        update_id = next(self._ids)
+        return {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "chat_instance": str(self.chat_id),
+                "from": self._user(user_id),
+                "data": data,
+                "message": {
+                    "message_id": card_message_id,
+                    "date": int(time.time()),
+                    "chat": self._chat(),
+                    "message_thread_id": self.topic_id,
+                    "is_topic_message": True,
+                    "text": "card",
+                },
+            },
+        }
+
+    def join(self, user_id: int) -> dict:
+        now = int(time.time())
+        return {
+            "update_id": next(self._ids),
+            "chat_member": {
+                "chat": self._chat(),
+                "from": self._user(user_id),
+                "date": now,
+                "old_chat_member": {"status": "left", "user": self._user(user_id)},
+                "new_chat_member": {"status": "member", "user": self._user(user_id)},
+            },
+        }
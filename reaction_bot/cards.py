@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from keyboards import simple_kb, task_kb
+from records import Task
+
+log = logging.getLogger(__name__)
+
+
+def task_card_text(task: Task, count: int) -> str:
+    text = (
+        f"Задание #{task.id}\n"
+        f"Ссылка: {task.post_url}\n"
+        f"Выполнили: {count}"
+    )
+    if not task.active:
+        text += "\nНеделя закончилась, приём закрыт."
+    return text
+
+
+def task_card_kb(task: Task):
+    return task_kb(task.id) if task.active else simple_kb()
+
+
+class CardRefresher:
+    """
+    Обновляет карточки заданий не чаще одного раза в interval секунд на карточку.
+    Клики между правками склеиваются: в момент отправки берётся свежий счётчик,
+    а правка с тем же текстом не отправляется вовсе. Задания правок, проснувшихся
+    в одном проходе цикла событий, читаются из базы одним get_tasks.
+    """
+
+    def __init__(self, bot: Bot, chats, interval: float = 3.0, max_cards: int = 10000):
+        self.bot = bot
+        self.chats = chats
+        self.interval = interval
+        self.max_cards = max_cards
+
+        # (chat_id, message_id) -> (текст последней правки, когда отправлена)
+        self._sent: "OrderedDict[tuple[int, int], tuple[str, float]]" = OrderedDict()
+        self._pending: dict[tuple[int, int], asyncio.Task] = {}
+        self._closing: set[asyncio.Task] = set()
+        # chat_id -> {task_id: future} — задания, ждущие общего get_tasks
+        self._loads: dict[int, dict[int, asyncio.Future]] = {}
+        self._loaders: set[asyncio.Task] = set()
+
+    def schedule(self, chat_id: int, message_id: int, task_id: int):
+        key = (chat_id, message_id)
+        if key in self._pending:
+            return
+        self._pending[key] = asyncio.create_task(self._refresh(key, task_id))
+
+    async def _refresh(self, key: tuple[int, int], task_id: int):
+        try:
+            _, sent_at = self._sent.get(key, ("", 0.0))
+            delay = sent_at + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            # с этого момента новые клики планируют следующую правку,
+            # не раньше чем через interval от текущей
+            self._pending.pop(key, None)
+            last_text, _ = self._sent.get(key, ("", 0.0))
+            self._remember(key, last_text)
+            task = await self._load_task(key[0], task_id)
+            if task is not None:
+                await self._edit(key, task, last_text)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("card refresh failed: %s", key)
+        finally:
+            if self._pending.get(key) is asyncio.current_task():
+                self._pending.pop(key, None)
+
+    async def _load_task(self, chat_id: int, task_id: int) -> Optional[Task]:
+        loop = asyncio.get_running_loop()
+        waiting = self._loads.get(chat_id)
+        if waiting is None:
+            # первый в этом проходе: запрос уйдёт, когда проснутся остальные
+            waiting = self._loads[chat_id] = {}
+            loop.call_soon(self._start_load, chat_id)
+        fut = waiting.get(task_id)
+        if fut is None:
+            fut = waiting[task_id] = loop.create_future()
+        # shield: отмена одной правки не должна отменять общий future
+        return await asyncio.shield(fut)
+
+    def _start_load(self, chat_id: int):
+        t = asyncio.create_task(self._load(chat_id, self._loads.pop(chat_id)))
+        self._loaders.add(t)
+        t.add_done_callback(self._loaders.discard)
+
+    async def _load(self, chat_id: int, waiting: dict[int, asyncio.Future]):
+        try:
+            tasks = await self.chats.db_for(chat_id).get_tasks(list(waiting))
+        except asyncio.CancelledError:
+            for fut in waiting.values():
+                fut.cancel()
+            raise
+        except Exception as e:
+            for fut in waiting.values():
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for task_id, fut in waiting.items():
+            if not fut.done():
+                fut.set_result(tasks.get(task_id))
+
+    async def _edit(self, key: tuple[int, int], task: Task, last_text: str):
+        chat_id, message_id = key
+        count = await self.chats.db_for(chat_id).count_completions(task.id)
+        text = task_card_text(task, count)
+        if text == last_text:
+            return
+
+        for _ in range(2):
+            try:
+                await self.bot.edit_message_text(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    text=text,
+                    reply_markup=task_card_kb(task),
+                )
+            except TelegramRetryAfter as e:
+                log.warning("card %s: flood control, retry after %s s", key, e.retry_after)
+                await asyncio.sleep(e.retry_after)
+                continue
+            except TelegramBadRequest:
+                # "message is not modified" / сообщение удалено
+                pass
+            self._remember(key, text)
+            return
+
+    def close_cards(self, chat_id: int, tasks: list[Task], per_minute: int):
+        """Переписывает карточки закрытых заданий в фоне, не чаще per_minute правок в минуту."""
+        if not tasks:
+            return
+        t = asyncio.create_task(self._close_cards(chat_id, tasks, 60 / max(1, per_minute)))
+        self._closing.add(t)
+        t.add_done_callback(self._closing.discard)
+
+    async def _close_cards(self, chat_id: int, tasks: list[Task], pause: float):
+        for task in tasks:
+            key = (chat_id, task.card_message_id)
+            # отложенная правка от клика несёт ещё активное задание — она больше не нужна
+            pending = self._pending.pop(key, None)
+            if pending is not None:
+                pending.cancel()
+            try:
+                last_text, _ = self._sent.get(key, ("", 0.0))
+                await self._edit(key, task, last_text)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("closing card failed: %s", key)
+            await asyncio.sleep(pause)
+
+    def _remember(self, key: tuple[int, int], text: str):
+        self._sent[key] = (text, time.monotonic())
+        self._sent.move_to_end(key)
+        while len(self._sent) > self.max_cards:
+            self._sent.popitem(last=False)
+
+    async def close(self):
+        tasks = [*self._pending.values(), *self._closing, *self._loaders]
+        self._pending.clear()
+        self._closing.clear()
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
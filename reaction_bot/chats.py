@@ -0,0 +1,154 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from db import Database
+
+log = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ChatSettings:
+    chat_id: int
+    topic_id: int                 # тема заданий
+    welcome_topic_id: Optional[int]
+    weekly_task_limit: int
+    tz: str
+    db_path: Optional[str]        # свой файл SQLite; None — общая база
+
+
+class ChatRegistry:
+    """
+    Чаты, которые обслуживает бот, и базы, где лежат их данные.
+    Настройки хранятся в таблице chats общей базы и целиком держатся в памяти;
+    чат из конфига (CHAT_ID/TOPIC_ID/...) заносится туда при старте.
+    Чат с db_path получает отдельную Database, чтобы его записи
+    не стояли в одной очереди с остальными.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        config,
+        refresh_interval: float = 30.0,
+        on_open: Optional[Callable[[Database], None]] = None,
+        open_database: Optional[Callable[[str], Database]] = None,
+    ):
+        self.db = db
+        self.config = config
+        self.refresh_interval = refresh_interval
+        self.on_open = on_open      # вызывается для каждой новой базы чата (метрики)
+        # как открыть базу чата по пути; по умолчанию — своя Database (воркеры подставляют заместитель)
+        self.open_database = open_database
+
+        self._chats: dict[int, ChatSettings] = {}
+        self._shards: dict[str, Database] = {}
+        self._version = -1
+        self._watcher: Optional[asyncio.Task] = None
+
+    async def start(self, register_config_chat: bool = True):
+        if register_config_chat:
+            # чат из конфига: настройки берём из env, а db_path (если задан командой) не трогаем
+            c = self.config
+            existing = {row["chat_id"]: row for row in await self.db.get_chats()}
+            db_path = existing.get(c.chat_id, {}).get("db_path")
+            await self.db.upsert_chat(c.chat_id, c.topic_id, c.welcome_topic_id, c.weekly_task_limit, c.tz, db_path)
+        await self.reload()
+        self._watcher = asyncio.create_task(self._watch())
+
+    async def close(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+        for shard in self._shards.values():
+            await shard.close()
+        self._shards.clear()
+
+    def get(self, chat_id: int) -> Optional[ChatSettings]:
+        return self._chats.get(chat_id)
+
+    def all(self) -> list[ChatSettings]:
+        return list(self._chats.values())
+
+    def databases(self) -> list[Database]:
+        return [self.db, *self._shards.values()]
+
+    def db_for(self, chat_id: int) -> Database:
+        chat = self._chats.get(chat_id)
+        if chat is None or not chat.db_path:
+            return self.db
+        return self._shards[chat.db_path]
+
+    async def reload(self):
+        version = await self.db.table_version("chats")
+        chats = {row["chat_id"]: ChatSettings(**row) for row in await self.db.get_chats()}
+
+        for chat in chats.values():
+            self.db.chat_tz[chat.chat_id] = chat.tz
+            if not chat.db_path:
+                continue
+            if chat.db_path not in self._shards:
+                shard = self._open_shard(chat.db_path)
+                # часовые пояса нужны уже в init() — для дозаполнения топов
+                shard.chat_tz.update({x.chat_id: x.tz for x in chats.values() if x.db_path == chat.db_path})
+                await shard.init()
+                self._shards[chat.db_path] = shard
+            self._shards[chat.db_path].chat_tz[chat.chat_id] = chat.tz
+
+        self._chats = chats
+        self._version = version
+        log.info("serving %d chat(s), %d separate database(s)", len(chats), len(self._shards))
+
+    def _open_shard(self, path: str) -> Database:
+        if self.open_database is not None:
+            return self.open_database(path)
+        c = self.config
+        shard = Database(
+            path,
+            tz=c.tz,
+            pool_size=c.db_pool_size,
+            busy_timeout=c.db_busy_timeout,
+            batch_interval=c.db_batch_interval_ms / 1000,
+            batch_max_ops=c.db_batch_max_ops,
+            ban_refresh_interval=c.ban_refresh_interval,
+            cache_size_kb=c.db_cache_size_kb,
+            mmap_size_mb=c.db_mmap_size_mb,
+        )
+        if self.on_open is not None:
+            self.on_open(shard)
+        return shard
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                if await self.db.table_version("chats") != self._version:
+                    await self.reload()
+            except Exception:
+                log.exception("failed to reload chats")
+
+
+class ChatMiddleware(BaseMiddleware):
+    """
+    Подставляет в хендлеры настройки чата (chat_settings, None — чат не обслуживается)
+    и базу этого чата вместо общей (db).
+    """
+
+    def __init__(self, chats: ChatRegistry):
+        self.chats = chats
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat = data.get("event_chat")
+        data["chat_settings"] = self.chats.get(chat.id) if chat else None
+        if chat is not None:
+            data["db"] = self.chats.db_for(chat.id)
+        return await handler(event, data)
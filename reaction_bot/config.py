@@ -15,6 +15,49 @@ class Config:
     tz: str
     weekly_task_limit: int
     welcome_delete_after: int
+    welcome_window: float         # сек., за которые входы склеиваются в одно приветствие
+    welcome_per_minute: int       # приветствий в чат в минуту
+    db_pool_size: int             # соединений на чтение
+    db_busy_timeout: float        # сек. ожидания блокировки SQLite
+    db_batch_interval_ms: int     # окно пакетной записи зачётов
+    db_batch_max_ops: int         # макс. операций в одной пачке
+    ban_refresh_interval: float   # сек. между проверками версии таблицы bans
+    db_cache_size_kb: int         # кэш страниц SQLite на соединение
+    db_mmap_size_mb: int          # сколько файла базы читать через mmap
+    db_maintenance_interval: float  # сек. между проходами обслуживания (maintenance.py)
+    db_wal_checkpoint_mb: float   # WAL больше — PASSIVE checkpoint
+    db_wal_truncate_mb: float     # WAL больше — TRUNCATE checkpoint
+    db_quiet_seconds: float       # столько без записей — можно ANALYZE и vacuum
+    db_analyze_interval: float    # сек. между ANALYZE
+    db_vacuum_pages: int          # страниц за один incremental_vacuum
+    card_edit_interval: float     # сек. между правками одной карточки
+    profile_ttl: int              # сек. жизни закэшированного имени
+    profile_cache_size: int
+    profile_fetch_concurrency: int
+    leaderboard_max_staleness: float  # сек., сколько можно отдавать устаревший топ
+    rollover_edits_per_minute: int  # правок карточек закрытых заданий на смене недели
+    throttle_rate: float          # нажатий в секунду на пользователя и вид кнопки
+    throttle_burst: int
+    throttle_chat_per_minute: int  # ответов-сообщений (топ, прогресс, правила) на чат в минуту
+    metrics_host: str
+    metrics_port: int             # порт страницы /metrics; 0 — выключено
+    runtime_profile: str          # default / fast (uvloop, orjson, пул соединений), см. runtime.py
+    api_pool_size: int            # соединений к Bot API в профиле fast
+    api_keepalive: float          # сек. держать простаивающее соединение
+    api_timeout: float            # сек. на запрос к Bot API (к getUpdates прибавляется таймаут polling)
+
+    mode: str                     # polling / webhook
+    drop_pending_updates: bool    # выкидывать накопившиеся апдейты при старте
+    webhook_url: str              # внешний адрес; пусто — setWebhook не вызываем
+    webhook_path: str
+    webhook_secret: str
+    webhook_host: str
+    webhook_port: int
+    webhook_queue_size: int
+    webhook_workers: int
+    webhook_enqueue_timeout: float
+    workers: int                  # процессов-воркеров (см. workers.py); 0 — всё в одном процессе
+    worker_concurrency: int       # апдейтов в обработке на воркер одновременно
 
 
 def load_config() -> Config:
@@ -27,4 +70,46 @@ def load_config() -> Config:
         tz=os.getenv("TZ", "Europe/Moscow"),
         weekly_task_limit=int(os.getenv("WEEKLY_TASK_LIMIT", "10")),
         welcome_delete_after=int(os.getenv("WELCOME_DELETE_AFTER", "60")),
+        welcome_window=float(os.getenv("WELCOME_WINDOW", "3")),
+        welcome_per_minute=int(os.getenv("WELCOME_PER_MINUTE", "4")),
+        db_pool_size=int(os.getenv("DB_POOL_SIZE", "4")),
+        db_busy_timeout=float(os.getenv("DB_BUSY_TIMEOUT", "5")),
+        db_batch_interval_ms=int(os.getenv("DB_BATCH_INTERVAL_MS", "20")),
+        db_batch_max_ops=int(os.getenv("DB_BATCH_MAX_OPS", "100")),
+        ban_refresh_interval=float(os.getenv("BAN_REFRESH_INTERVAL", "10")),
+        db_cache_size_kb=int(os.getenv("DB_CACHE_SIZE_KB", "8192")),
+        db_mmap_size_mb=int(os.getenv("DB_MMAP_SIZE_MB", "64")),
+        db_maintenance_interval=float(os.getenv("DB_MAINTENANCE_INTERVAL", "60")),
+        db_wal_checkpoint_mb=float(os.getenv("DB_WAL_CHECKPOINT_MB", "16")),
+        db_wal_truncate_mb=float(os.getenv("DB_WAL_TRUNCATE_MB", "64")),
+        db_quiet_seconds=float(os.getenv("DB_QUIET_SECONDS", "30")),
+        db_analyze_interval=float(os.getenv("DB_ANALYZE_INTERVAL", "21600")),
+        db_vacuum_pages=int(os.getenv("DB_VACUUM_PAGES", "1000")),
+        card_edit_interval=float(os.getenv("CARD_EDIT_INTERVAL", "3")),
+        profile_ttl=int(os.getenv("PROFILE_TTL", "86400")),
+        profile_cache_size=int(os.getenv("PROFILE_CACHE_SIZE", "5000")),
+        profile_fetch_concurrency=int(os.getenv("PROFILE_FETCH_CONCURRENCY", "5")),
+        leaderboard_max_staleness=float(os.getenv("LEADERBOARD_MAX_STALENESS", "10")),
+        rollover_edits_per_minute=int(os.getenv("ROLLOVER_EDITS_PER_MINUTE", "20")),
+        throttle_rate=float(os.getenv("THROTTLE_RATE", "0.5")),
+        throttle_burst=int(os.getenv("THROTTLE_BURST", "3")),
+        throttle_chat_per_minute=int(os.getenv("THROTTLE_CHAT_PER_MINUTE", "20")),
+        metrics_host=os.getenv("METRICS_HOST", "127.0.0.1"),
+        metrics_port=int(os.getenv("METRICS_PORT", "0")),
+        runtime_profile=os.getenv("RUNTIME_PROFILE", "default"),
+        api_pool_size=int(os.getenv("API_POOL_SIZE", "50")),
+        api_keepalive=float(os.getenv("API_KEEPALIVE", "60")),
+        api_timeout=float(os.getenv("API_TIMEOUT", "30")),
+        mode=os.getenv("BOT_MODE", "polling"),
+        drop_pending_updates=os.getenv("DROP_PENDING_UPDATES", "1") == "1",
+        webhook_url=os.getenv("WEBHOOK_URL", ""),
+        webhook_path=os.getenv("WEBHOOK_PATH", "/webhook"),
+        webhook_secret=os.getenv("WEBHOOK_SECRET", ""),
+        webhook_host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+        webhook_port=int(os.getenv("WEBHOOK_PORT", "8080")),
+        webhook_queue_size=int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000")),
+        webhook_workers=int(os.getenv("WEBHOOK_WORKERS", "8")),
+        webhook_enqueue_timeout=float(os.getenv("WEBHOOK_ENQUEUE_TIMEOUT", "5")),
+        workers=int(os.getenv("WORKERS", "0")),
+        worker_concurrency=int(os.getenv("WORKER_CONCURRENCY", "100")),
     )
\ No newline at end of file
@@ -1,7 +1,26 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
 import aiosqlite
-from typing import Optional
 
+from periods import period_bounds
+from records import BAN_COLUMNS, COMPLETION_COLUMNS, TASK_COLUMNS, Ban, Completion, Task
+from utils import week_range_msk, month_range_msk
+
+log = logging.getLogger(__name__)
+
+# Схема последней версии: новая база создаётся сразу такой (и получает
+# user_version = len(MIGRATIONS)), существующие доводят до неё MIGRATIONS.
+# На старой базе всё здесь — IF NOT EXISTS, поэтому выполняется до миграций:
+# добавляет таблицы, появившиеся без миграции, а старые таблицы не трогает.
 SCHEMA = """
+-- действует только на новой базе; существующую переводит `manage.py vacuum`
+PRAGMA auto_vacuum=INCREMENTAL;
 PRAGMA journal_mode=WAL;
 
 CREATE TABLE IF NOT EXISTS tasks (
@@ -10,10 +29,11 @@ CREATE TABLE IF NOT EXISTS tasks (
     topic_id INTEGER NOT NULL,
     created_by INTEGER NOT NULL,
     post_url TEXT NOT NULL,
-    post_key TEXT NOT NULL UNIQUE,
+    post_key TEXT NOT NULL,
     created_at INTEGER NOT NULL,
     active INTEGER NOT NULL DEFAULT 1,
-    card_message_id INTEGER
+    card_message_id INTEGER,
+    UNIQUE(chat_id, post_key)
 );
 
 CREATE TABLE IF NOT EXISTS completions (
@@ -38,194 +58,1122 @@ CREATE TABLE IF NOT EXISTS bot_messages (
     PRIMARY KEY(chat_id, topic_id, kind)
 );
 
-CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks(created_at);
+-- Материализованные топы: число выполнений пользователя за неделю/месяц.
+-- Обновляются в той же транзакции, что и completions.
+CREATE TABLE IF NOT EXISTS leaderboard (
+    chat_id INTEGER NOT NULL,
+    period TEXT NOT NULL,           -- week/month
+    period_start INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    completions INTEGER NOT NULL,
+    PRIMARY KEY(chat_id, period, period_start, user_id)
+);
+
+-- Кэш отображаемых имён (для топов без get_chat_member на каждого)
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    updated_at INTEGER NOT NULL
+);
+
+-- Отложенные удаления сообщений бота (переживают перезапуск)
+CREATE TABLE IF NOT EXISTS scheduled_deletions (
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    delete_at INTEGER NOT NULL,
+    PRIMARY KEY(chat_id, message_id)
+);
+
+-- Настройки чатов, в которых работает бот (см. chats.py)
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id INTEGER PRIMARY KEY,
+    topic_id INTEGER NOT NULL,          -- тема заданий
+    welcome_topic_id INTEGER,           -- тема приветствий
+    weekly_task_limit INTEGER NOT NULL,
+    tz TEXT NOT NULL,
+    db_path TEXT                        -- отдельный файл под данные чата; NULL — общий
+);
+
+-- Сводки по закрытым месяцам: сырые completions оттуда удалены (см. compact_completions)
+CREATE TABLE IF NOT EXISTS completion_months (
+    chat_id INTEGER NOT NULL,
+    month_start INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    completions INTEGER NOT NULL,
+    PRIMARY KEY(chat_id, month_start, user_id)
+);
+CREATE TABLE IF NOT EXISTS task_totals (
+    task_id INTEGER PRIMARY KEY,
+    completions INTEGER NOT NULL        -- выполнения, уже убранные из completions
+);
+CREATE TABLE IF NOT EXISTS compactions (
+    chat_id INTEGER PRIMARY KEY,
+    compacted_before INTEGER NOT NULL   -- completions чата раньше этой отметки — только в сводках
+);
+
+-- Версии таблиц, которые держим в памяти целиком. Меняются триггерами,
+-- поэтому правка bans снаружи (sqlite3 и т.п.) тоже видна боту.
+CREATE TABLE IF NOT EXISTS table_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO table_versions(name, version) VALUES('bans', 0);
+INSERT OR IGNORE INTO table_versions(name, version) VALUES('chats', 0);
+
+CREATE TRIGGER IF NOT EXISTS trg_bans_version_ins AFTER INSERT ON bans
+BEGIN UPDATE table_versions SET version = version + 1 WHERE name = 'bans'; END;
+CREATE TRIGGER IF NOT EXISTS trg_bans_version_upd AFTER UPDATE ON bans
+BEGIN UPDATE table_versions SET version = version + 1 WHERE name = 'bans'; END;
+CREATE TRIGGER IF NOT EXISTS trg_bans_version_del AFTER DELETE ON bans
+BEGIN UPDATE table_versions SET version = version + 1 WHERE name = 'bans'; END;
+
+CREATE TRIGGER IF NOT EXISTS trg_chats_version_ins AFTER INSERT ON chats
+BEGIN UPDATE table_versions SET version = version + 1 WHERE name = 'chats'; END;
+CREATE TRIGGER IF NOT EXISTS trg_chats_version_upd AFTER UPDATE ON chats
+BEGIN UPDATE table_versions SET version = version + 1 WHERE name = 'chats'; END;
+CREATE TRIGGER IF NOT EXISTS trg_chats_version_del AFTER DELETE ON chats
+BEGIN UPDATE table_versions SET version = version + 1 WHERE name = 'chats'; END;
+
+CREATE INDEX IF NOT EXISTS idx_tasks_chat_created_by ON tasks(chat_id, created_by, created_at);
+CREATE INDEX IF NOT EXISTS idx_tasks_active ON tasks(chat_id, created_at) WHERE active = 1;
 CREATE INDEX IF NOT EXISTS idx_completions_completed_at ON completions(completed_at);
+CREATE INDEX IF NOT EXISTS idx_leaderboard_top ON leaderboard(chat_id, period, period_start, completions DESC, user_id);
+"""
+
+# Миграции существующих баз к SCHEMA. Номер применённой хранится в PRAGMA user_version;
+# новые добавляются только в конец списка, и SCHEMA правится вместе с ними.
+MIGRATIONS = [
+    # 1: индексы под лимит заданий и "Мой прогресс"
+    """
+    CREATE INDEX IF NOT EXISTS idx_tasks_created_by_created_at ON tasks(created_by, created_at);
+    CREATE INDEX IF NOT EXISTS idx_completions_user_completed_at ON completions(user_id, completed_at);
+    """,
+    # 2: данные нескольких чатов в одной базе: дубли ссылок и топы — в пределах чата.
+    # leaderboard пересоздаётся пустым и заполняется заново при старте.
+    """
+    CREATE TABLE tasks_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        topic_id INTEGER NOT NULL,
+        created_by INTEGER NOT NULL,
+        post_url TEXT NOT NULL,
+        post_key TEXT NOT NULL,
+        created_at INTEGER NOT NULL,
+        active INTEGER NOT NULL DEFAULT 1,
+        card_message_id INTEGER,
+        UNIQUE(chat_id, post_key)
+    );
+    INSERT INTO tasks_new(id, chat_id, topic_id, created_by, post_url, post_key, created_at, active, card_message_id)
+    SELECT id, chat_id, topic_id, created_by, post_url, post_key, created_at, active, card_message_id FROM tasks;
+    DROP TABLE tasks;
+    ALTER TABLE tasks_new RENAME TO tasks;
+    CREATE INDEX idx_tasks_chat_created_by ON tasks(chat_id, created_by, created_at);
+
+    DROP TABLE leaderboard;
+    CREATE TABLE leaderboard (
+        chat_id INTEGER NOT NULL,
+        period TEXT NOT NULL,
+        period_start INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        completions INTEGER NOT NULL,
+        PRIMARY KEY(chat_id, period, period_start, user_id)
+    );
+    CREATE INDEX idx_leaderboard_top ON leaderboard(chat_id, period, period_start, completions DESC, user_id);
+    """,
+    # 3: активные задания чата по дате создания — для закрытия прошлых недель
+    """
+    CREATE INDEX IF NOT EXISTS idx_tasks_active ON tasks(chat_id, created_at) WHERE active = 1;
+    """,
+    # 4: индексы, которые больше ничего не читает, а каждая вставка обновляет:
+    # "Мой прогресс" считается из leaderboard, закрытие недели идёт по idx_tasks_active
+    """
+    DROP INDEX IF EXISTS idx_completions_user_completed_at;
+    DROP INDEX IF EXISTS idx_tasks_created_at;
+    """,
+]
+
+# Схема холодного архива (отдельный файл, подключается как archive)
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive.tasks (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    topic_id INTEGER NOT NULL,
+    created_by INTEGER NOT NULL,
+    post_url TEXT NOT NULL,
+    post_key TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    active INTEGER NOT NULL,
+    card_message_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS archive.completions (
+    chat_id INTEGER NOT NULL,
+    task_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    completed_at INTEGER NOT NULL,
+    PRIMARY KEY(task_id, user_id)
+);
+"""
+
+PERIODS = {
+    "week": week_range_msk,
+    "month": month_range_msk,
+}
+
+# Запросы горячего пути — постоянные строки: sqlite3 кэширует подготовленные
+# выражения по тексту SQL на каждом соединении (см. cached_statements в _connect).
+# Списки передаются одним JSON-параметром через json_each, а не "IN (?, ?, ...)",
+# чтобы текст запроса не зависел от длины списка.
+SELECT_TASK = f"SELECT {TASK_COLUMNS} FROM tasks WHERE id = ?"
+# CROSS JOIN фиксирует порядок: идём по списку и ищем каждое задание по индексу,
+# даже если статистика (ANALYZE) считает таблицу маленькой
+_TASK_COLUMNS_QUALIFIED = ", ".join(f"tasks.{c}" for c in TASK_COLUMNS.split(", "))
+SELECT_TASKS = (
+    f"SELECT {_TASK_COLUMNS_QUALIFIED} FROM json_each(?) AS ids CROSS JOIN tasks ON tasks.id = ids.value"
+)
+SELECT_TASKS_BY_POST_KEYS = (
+    f"SELECT {_TASK_COLUMNS_QUALIFIED} FROM json_each(?) AS keys CROSS JOIN tasks"
+    " ON tasks.chat_id = ? AND tasks.post_key = keys.value"
+)
+SELECT_USER_NAMES = (
+    "SELECT users.user_id, users.name, users.updated_at"
+    " FROM json_each(?) AS ids CROSS JOIN users ON users.user_id = ids.value"
+)
+# Выгрузка (export.py): выполнения чата; сами задания выгрузка берёт пачкой через get_tasks.
+# CROSS JOIN — идём по индексу completed_at: строки выходят уже по порядку,
+# без сортировки всей истории чата во временном B-дереве перед первой строкой
+_COMPLETION_COLUMNS_QUALIFIED = ", ".join(f"c.{c}" for c in COMPLETION_COLUMNS.split(", "))
+SELECT_COMPLETIONS_EXPORT = f"""
+    SELECT {_COMPLETION_COLUMNS_QUALIFIED}
+    FROM completions c
+    CROSS JOIN tasks t ON t.id = c.task_id
+    WHERE c.completed_at BETWEEN ? AND ? AND t.chat_id = ?
+    ORDER BY c.completed_at
 """
 
 class Database:
-    def __init__(self, path: str):
+    def __init__(
+        self,
+        path: str,
+        tz: str = "Europe/Moscow",
+        pool_size: int = 4,
+        busy_timeout: float = 5.0,
+        batch_interval: float = 0.02,
+        batch_max_ops: int = 100,
+        ban_refresh_interval: float = 10.0,
+        cached_statements: int = 256,
+        cache_size_kb: int = 8192,
+        mmap_size_mb: int = 64,
+    ):
         self.path = path
+        self.tz = tz
+        # chat_id -> часовой пояс чата; по умолчанию self.tz
+        self.chat_tz: dict[int, str] = {}
+        self.pool_size = max(1, pool_size)
+        self.busy_timeout = busy_timeout
+        self.batch_interval = batch_interval
+        self.batch_max_ops = max(1, batch_max_ops)
+        self.ban_refresh_interval = ban_refresh_interval
+        self.cached_statements = cached_statements
+        # на каждое соединение: с WAL synchronous=NORMAL не теряет целостность,
+        # только последние коммиты при отключении питания
+        self.pragmas = (
+            "PRAGMA synchronous = NORMAL",
+            f"PRAGMA cache_size = {-int(cache_size_kb)}",
+            f"PRAGMA mmap_size = {int(mmap_size_mb) * 1024 * 1024}",
+            "PRAGMA temp_store = MEMORY",
+        )
+        # когда в последний раз писали (кроме обслуживания) — для поиска тихих периодов
+        self.last_write_at = time.monotonic()
+
+        # Одно соединение на запись (SQLite всё равно пишет последовательно)
+        # и ограниченный пул соединений на чтение. Открываются в init().
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._readers: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+        self._all_readers: list[aiosqlite.Connection] = []
+        self._trace_callback = None
+
+        # Очередь зачётов/отмен: пишутся пачкой в одной транзакции
+        # (раз в batch_interval сек. или по набору batch_max_ops операций).
+        self._pending: list[tuple[str, int, int, int, int, asyncio.Future]] = []
+        self._batch_ready = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+        self._closing = False
+
+        # task_id -> число выполнений. Прогревается в init() и меняется
+        # только после коммита пачки, в которой изменились completions.
+        self._completion_counts: dict[int, int] = {}
+
+        # Активные задания: task_id -> (chat_id, created_at). Прогреваются в init(),
+        # пополняются в create_tasks и чистятся при закрытии недели, так что клик
+        # узнаёт, принимается ли задание, без запроса к базе. Задания нет — закрыто.
+        self._active_tasks: dict[int, tuple[int, int]] = {}
+
+        # Версии топов: (chat_id, period, period_start) -> номер последнего коммита,
+        # изменившего этот период. По ним кэш топов понимает, что устарел.
+        self._leaderboard_seq = 0
+        self._leaderboard_rebuilt = 0
+        self._leaderboard_versions: dict[tuple[int, str, int], int] = {}
+
+        # Баны целиком в памяти: user_id -> banned_until (None = навсегда).
+        # Перечитываются, если сменилась версия таблицы bans.
+        self._bans: dict[int, Optional[int]] = {}
+        self._bans_version = -1
+        self._ban_watcher: Optional[asyncio.Task] = None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(
+            self.path, timeout=self.busy_timeout, cached_statements=self.cached_statements
+        )
+        for pragma in self.pragmas:
+            await conn.execute(pragma)
+        if self._trace_callback is not None:
+            await conn.set_trace_callback(self._trace_callback)
+        return conn
 
     async def init(self):
-        async with aiosqlite.connect(self.path) as db:
-            await db.executescript(SCHEMA)
-            await db.commit()
+        self._writer = await self._connect()
+        cur = await self._writer.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tasks'")
+        new = await cur.fetchone() is None
+        await cur.close()
+        await self._writer.executescript(SCHEMA)
+        if new:
+            await self._writer.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+        await self._writer.commit()
+        await self._migrate()
+        await self._writer.create_function("period_start", 3, self._period_start)
 
-    async def is_banned(self, user_id: int, now_ts: int) -> bool:
-        async with aiosqlite.connect(self.path) as db:
-            cur = await db.execute(
-                "SELECT banned_until FROM bans WHERE user_id = ?",
-                (user_id,),
+        for _ in range(self.pool_size):
+            conn = await self._connect()
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+
+        for chat in await self.get_chats():
+            self.chat_tz.setdefault(chat["chat_id"], chat["tz"])
+        await self._warm_completion_counts()
+        await self._warm_active_tasks()
+        if await self._leaderboard_needs_backfill():
+            await self.rebuild_leaderboards()
+        await self.reload_bans_if_changed()
+        self._flusher = asyncio.create_task(self._flush_loop())
+        self._ban_watcher = asyncio.create_task(self._watch_bans())
+
+    async def _migrate(self):
+        cur = await self._writer.execute("PRAGMA user_version")
+        version = (await cur.fetchone())[0]
+        await cur.close()
+
+        for number, script in enumerate(MIGRATIONS[version:], start=version + 1):
+            log.info("applying schema migration %d", number)
+            await self._writer.executescript(
+                f"BEGIN;\n{script}\nPRAGMA user_version = {number};\nCOMMIT;"
             )
+
+    async def set_trace_callback(self, callback):
+        """Трассировка SQL на всех соединениях (для проверки планов запросов)."""
+        self._trace_callback = callback
+        for conn in (self._writer, *self._all_readers):
+            await conn.set_trace_callback(callback)
+
+    async def close(self):
+        if self._ban_watcher is not None:
+            self._ban_watcher.cancel()
+            self._ban_watcher = None
+        if self._flusher is not None:
+            # без cancel: отмена посреди _flush_completions потеряла бы пачку,
+            # а её future так и остались бы висеть. Будим цикл — он сбросит
+            # накопленное без ожидания интервала и выйдет по флагу
+            self._closing = True
+            self._batch_ready.set()
+            self._batch_full.set()
+            await self._flusher
+            self._flusher = None
+        if self._pending:
+            batch, self._pending = self._pending, []
+            await self._flush_completions(batch)
+
+        # PRAGMA optimize перед закрытием: ANALYZE тех таблиц, где статистика
+        # разошлась с тем, что видели запросы этого соединения
+        for conn in self._all_readers:
+            await _optimize_quietly(conn)
+            await conn.close()
+        self._all_readers.clear()
+        self._readers = asyncio.Queue()
+
+        if self._writer is not None:
+            await _optimize_quietly(self._writer)
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def _read(self):
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def _write(self, maintenance: bool = False):
+        async with self._write_lock:
+            if not maintenance:
+                self.last_write_at = time.monotonic()
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+    # ====== обслуживание файла (см. maintenance.py) ======
+
+    def wal_size(self) -> int:
+        """Размер файла -wal в байтах."""
+        try:
+            return os.path.getsize(self.path + "-wal")
+        except OSError:
+            return 0
+
+    async def checkpoint(self, mode: str = "PASSIVE") -> tuple[int, int, int]:
+        """
+        PRAGMA wal_checkpoint(mode). Возвращает (busy, страниц в WAL, перенесено в базу).
+        PASSIVE не ждёт читателей; TRUNCATE ждёт их (до busy_timeout) и обрезает -wal до нуля.
+        """
+        if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"unknown checkpoint mode: {mode}")
+        async with self._write(maintenance=True) as db:
+            cur = await db.execute(f"PRAGMA wal_checkpoint({mode})")
             row = await cur.fetchone()
             await cur.close()
+        return int(row[0]), int(row[1]), int(row[2])
+
+    async def analyze(self, limit: int = 1000):
+        """ANALYZE по выборке в limit строк на индекс: статистика для планировщика без полного прохода."""
+        async with self._write(maintenance=True) as db:
+            await db.execute(f"PRAGMA analysis_limit = {int(limit)}")
+            await db.execute("ANALYZE")
+            await db.commit()
+
+    async def incremental_vacuum(self, pages: int) -> int:
+        """Отдаёт системе до pages свободных страниц; возвращает, сколько было отдано."""
+        async with self._write(maintenance=True) as db:
+            cur = await db.execute("PRAGMA auto_vacuum")
+            mode = (await cur.fetchone())[0]
+            await cur.close()
+            if mode != 2:   # не INCREMENTAL: база создана до него и не переведена
+                return 0
+            cur = await db.execute("PRAGMA freelist_count")
+            free = (await cur.fetchone())[0]
+            await cur.close()
+            if not free:
+                return 0
+            cur = await db.execute(f"PRAGMA incremental_vacuum({int(pages)})")
+            await cur.fetchall()
+            await cur.close()
+            await db.commit()
+        return min(free, pages)
+
+    async def vacuum(self):
+        """Переводит базу на auto_vacuum=INCREMENTAL полным VACUUM (долго, блокирует запись)."""
+        async with self._write(maintenance=True) as db:
+            await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            await db.execute("VACUUM")
 
-            if not row:
+    # ====== bans (целиком в памяти) ======
+
+    async def is_banned(self, user_id: int, now_ts: int) -> bool:
+        if user_id not in self._bans:
+            return False
+        banned_until = self._bans[user_id]
+        if banned_until is None:
+            return True
+        if now_ts < banned_until:
+            return True
+        # бан истёк — из памяти убираем, строка в таблице остаётся как есть
+        self._bans.pop(user_id, None)
+        return False
+
+    async def ban_user(self, user_id: int, banned_until: Optional[int] = None):
+        async with self._write() as db:
+            await db.execute(
+                """
+                INSERT INTO bans(user_id, banned_until) VALUES(?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET banned_until=excluded.banned_until
+                """,
+                (user_id, banned_until),
+            )
+            version = await self._table_version(db, "bans")
+            await db.commit()
+        self._bans[user_id] = banned_until
+        self._bans_version = version
+
+    async def unban_user(self, user_id: int):
+        async with self._write() as db:
+            await db.execute("DELETE FROM bans WHERE user_id = ?", (user_id,))
+            version = await self._table_version(db, "bans")
+            await db.commit()
+        self._bans.pop(user_id, None)
+        self._bans_version = version
+
+    async def table_version(self, name: str) -> int:
+        async with self._read() as db:
+            return await self._table_version(db, name)
+
+    async def _table_version(self, db: aiosqlite.Connection, name: str) -> int:
+        cur = await db.execute("SELECT version FROM table_versions WHERE name = ?", (name,))
+        row = await cur.fetchone()
+        await cur.close()
+        return int(row[0]) if row else 0
+
+    async def reload_bans_if_changed(self) -> bool:
+        async with self._read() as db:
+            version = await self._table_version(db, "bans")
+            if version == self._bans_version:
                 return False
-            banned_until = row[0]
-            if banned_until is None:
-                return True
-            return now_ts < banned_until
+            bans = await _fetchall(db, Ban, f"SELECT {BAN_COLUMNS} FROM bans")
+
+        self._bans = {ban.user_id: ban.banned_until for ban in bans}
+        self._bans_version = version
+        return True
 
-    async def count_user_tasks_in_range(self, user_id: int, start_ts: int, end_ts: int) -> int:
-        async with aiosqlite.connect(self.path) as db:
+    async def _watch_bans(self):
+        while True:
+            await asyncio.sleep(self.ban_refresh_interval)
+            try:
+                await self.reload_bans_if_changed()
+            except Exception:
+                log.exception("failed to reload bans")
+
+    # ====== chats (настройки чатов) ======
+
+    async def get_chats(self) -> list[dict]:
+        async with self._read() as db:
             cur = await db.execute(
+                "SELECT chat_id, topic_id, welcome_topic_id, weekly_task_limit, tz, db_path FROM chats"
+            )
+            rows = await cur.fetchall()
+            await cur.close()
+        return [
+            {
+                "chat_id": r[0],
+                "topic_id": r[1],
+                "welcome_topic_id": r[2],
+                "weekly_task_limit": r[3],
+                "tz": r[4],
+                "db_path": r[5],
+            }
+            for r in rows
+        ]
+
+    async def upsert_chat(
+        self,
+        chat_id: int,
+        topic_id: int,
+        welcome_topic_id: Optional[int],
+        weekly_task_limit: int,
+        tz: str,
+        db_path: Optional[str] = None,
+    ):
+        async with self._write() as db:
+            await db.execute(
                 """
-                SELECT COUNT(*) FROM tasks
-                WHERE created_by = ? AND created_at BETWEEN ? AND ?
+                INSERT INTO chats(chat_id, topic_id, welcome_topic_id, weekly_task_limit, tz, db_path)
+                VALUES(?, ?, ?, ?, ?, ?)
+                ON CONFLICT(chat_id) DO UPDATE SET
+                    topic_id=excluded.topic_id,
+                    welcome_topic_id=excluded.welcome_topic_id,
+                    weekly_task_limit=excluded.weekly_task_limit,
+                    tz=excluded.tz,
+                    db_path=excluded.db_path
                 """,
-                (user_id, start_ts, end_ts),
+                (chat_id, topic_id, welcome_topic_id, weekly_task_limit, tz, db_path),
             )
-            row = await cur.fetchone()
-            await cur.close()
-            return int(row[0])
+            await db.commit()
+        self.chat_tz[chat_id] = tz
+
+    def tz_for(self, chat_id: int) -> str:
+        return self.chat_tz.get(chat_id, self.tz)
 
-    async def get_task_by_post_key(self, post_key: str) -> Optional[dict]:
-        async with aiosqlite.connect(self.path) as db:
+    # ====== tasks ======
+
+    async def count_user_tasks_in_range(self, chat_id: int, user_id: int, start_ts: int, end_ts: int) -> int:
+        async with self._read() as db:
             cur = await db.execute(
                 """
-                SELECT id, chat_id, topic_id, created_by, post_url, post_key, created_at, active, card_message_id
-                FROM tasks
-                WHERE post_key = ?
+                SELECT COUNT(*) FROM tasks
+                WHERE chat_id = ? AND created_by = ? AND created_at BETWEEN ? AND ?
                 """,
-                (post_key,),
+                (chat_id, user_id, start_ts, end_ts),
             )
             row = await cur.fetchone()
             await cur.close()
+            return int(row[0])
 
-            if not row:
-                return None
-            return {
-                "id": row[0],
-                "chat_id": row[1],
-                "topic_id": row[2],
-                "created_by": row[3],
-                "post_url": row[4],
-                "post_key": row[5],
-                "created_at": row[6],
-                "active": bool(row[7]),
-                "card_message_id": row[8],
-            }
+    async def get_tasks_by_post_keys(self, chat_id: int, post_keys: list[str]) -> dict[str, Task]:
+        """Задания чата по списку post_key одним запросом; ненайденных в ответе нет."""
+        if not post_keys:
+            return {}
+        async with self._read() as db:
+            tasks = await _fetchall(db, Task, SELECT_TASKS_BY_POST_KEYS, (json.dumps(post_keys), chat_id))
+        return {t.post_key: t for t in tasks}
 
-    async def create_task(
+    async def create_tasks(
         self,
         chat_id: int,
         topic_id: int,
         created_by: int,
-        post_url: str,
-        post_key: str,
+        links: list[tuple[str, str]],
         created_at: int,
-    ) -> int:
-        async with aiosqlite.connect(self.path) as db:
+        week_start: int,
+        week_end: int,
+        limit: int,
+    ) -> tuple[list[dict], int]:
+        """
+        Создаёт задания по ссылкам [(post_url, post_key)] одной транзакцией BEGIN IMMEDIATE:
+        проверка недельного лимита, дубли и вставка идут под одной блокировкой записи,
+        так что два одновременных поста одной ссылки не создадут два задания.
+        Возвращает ([{post_url, post_key, task_id, status}], создано автором за неделю),
+        status: created / exists (активное уже есть) / closed (было на прошлых неделях) / limit.
+        """
+        results = []
+        async with self._write() as db:
+            await db.execute("BEGIN IMMEDIATE")
             cur = await db.execute(
                 """
-                INSERT INTO tasks(chat_id, topic_id, created_by, post_url, post_key, created_at, active)
-                VALUES(?, ?, ?, ?, ?, ?, 1)
+                SELECT COUNT(*) FROM tasks
+                WHERE chat_id = ? AND created_by = ? AND created_at BETWEEN ? AND ?
                 """,
-                (chat_id, topic_id, created_by, post_url, post_key, created_at),
+                (chat_id, created_by, week_start, week_end),
             )
+            created_count = int((await cur.fetchone())[0])
+            await cur.close()
+
+            for post_url, post_key in links:
+                # сначала ищем дубль: на конфликте AUTOINCREMENT всё равно тратит номер,
+                # а номера заданий видны участникам
+                cur = await db.execute(
+                    "SELECT id, active FROM tasks WHERE chat_id = ? AND post_key = ?",
+                    (chat_id, post_key),
+                )
+                existing = await cur.fetchone()
+                await cur.close()
+                if existing is not None:
+                    status = "exists" if existing[1] else "closed"
+                    results.append({"post_url": post_url, "post_key": post_key, "task_id": int(existing[0]), "status": status})
+                    continue
+                if created_count >= limit:
+                    results.append({"post_url": post_url, "post_key": post_key, "task_id": None, "status": "limit"})
+                    continue
+
+                cur = await db.execute(
+                    """
+                    INSERT INTO tasks(chat_id, topic_id, created_by, post_url, post_key, created_at, active)
+                    VALUES(?, ?, ?, ?, ?, ?, 1)
+                    ON CONFLICT(chat_id, post_key) DO NOTHING
+                    RETURNING id
+                    """,
+                    (chat_id, topic_id, created_by, post_url, post_key, created_at),
+                )
+                row = await cur.fetchone()
+                await cur.close()
+                if row is None:
+                    # не должно случиться под BEGIN IMMEDIATE, но дубль не должен ронять пост
+                    results.append({"post_url": post_url, "post_key": post_key, "task_id": None, "status": "exists"})
+                    continue
+                created_count += 1
+                results.append({"post_url": post_url, "post_key": post_key, "task_id": int(row[0]), "status": "created"})
             await db.commit()
-            return int(cur.lastrowid)
 
-    async def set_task_card_message_id(self, task_id: int, card_message_id: int):
-        async with aiosqlite.connect(self.path) as db:
-            await db.execute(
+        for r in results:
+            if r["status"] == "created":
+                self._completion_counts[r["task_id"]] = 0
+                self._active_tasks[r["task_id"]] = (chat_id, created_at)
+        return results, created_count
+
+    async def set_task_card_message_ids(self, cards: list[tuple[int, int]]):
+        """Запоминает карточки [(task_id, card_message_id)] одной транзакцией."""
+        if not cards:
+            return
+        async with self._write() as db:
+            await db.executemany(
                 "UPDATE tasks SET card_message_id = ? WHERE id = ?",
-                (card_message_id, task_id),
+                [(card_message_id, task_id) for task_id, card_message_id in cards],
+            )
+            await db.commit()
+
+    async def deactivate_tasks_before(self, chat_id: int, before_ts: int) -> list[Task]:
+        """Снимает active с заданий чата, созданных раньше before_ts; возвращает закрытые."""
+        async with self._write() as db:
+            tasks = await _fetchall(
+                db,
+                Task,
+                f"""
+                UPDATE tasks SET active = 0
+                WHERE chat_id = ? AND active = 1 AND created_at < ?
+                RETURNING {TASK_COLUMNS}
+                """,
+                (chat_id, before_ts),
             )
             await db.commit()
+        for t in tasks:
+            self._active_tasks.pop(t.id, None)
+        return tasks
+
+    async def active_task(self, task_id: int) -> Optional[tuple[int, int]]:
+        """(chat_id, created_at) активного задания или None; базу не читает."""
+        return self._active_tasks.get(task_id)
+
+    async def _warm_active_tasks(self):
+        async with self._read() as db:
+            cur = await db.execute("SELECT id, chat_id, created_at FROM tasks WHERE active = 1")
+            rows = await cur.fetchall()
+            await cur.close()
+        self._active_tasks = {int(r[0]): (int(r[1]), int(r[2])) for r in rows}
+
+    async def get_task(self, task_id: int) -> Optional[Task]:
+        async with self._read() as db:
+            return await _fetchone(db, Task, SELECT_TASK, (task_id,))
 
-    async def get_task(self, task_id: int) -> Optional[dict]:
-        async with aiosqlite.connect(self.path) as db:
+    async def get_tasks(self, task_ids: list[int]) -> dict[int, Task]:
+        """Задания по списку id одним запросом; ненайденных в ответе нет."""
+        if not task_ids:
+            return {}
+        async with self._read() as db:
+            tasks = await _fetchall(db, Task, SELECT_TASKS, (json.dumps(task_ids),))
+        return {t.id: t for t in tasks}
+
+    async def count_completions(self, task_id: int) -> int:
+        count = self._completion_counts.get(task_id)
+        if count is None:
+            # промах — под блокировкой записи: пачка, закоммиченная между чтением
+            # и записью в кэш, иначе прошла бы мимо счётчика
+            async with self._write_lock:
+                count = self._completion_counts.get(task_id)
+                if count is None:
+                    count = await self._count_completions_db(task_id)
+                    self._completion_counts[task_id] = count
+        return count
+
+    async def _count_completions_db(self, task_id: int) -> int:
+        async with self._read() as db:
             cur = await db.execute(
                 """
-                SELECT id, chat_id, topic_id, created_by, post_url, post_key, created_at, active, card_message_id
-                FROM tasks WHERE id = ?
+                SELECT (SELECT COUNT(*) FROM completions WHERE task_id = :task_id)
+                     + COALESCE((SELECT completions FROM task_totals WHERE task_id = :task_id), 0)
                 """,
-                (task_id,),
+                {"task_id": task_id},
             )
             row = await cur.fetchone()
             await cur.close()
+            return int(row[0])
 
-            if not row:
-                return None
-            return {
-                "id": row[0],
-                "chat_id": row[1],
-                "topic_id": row[2],
-                "created_by": row[3],
-                "post_url": row[4],
-                "post_key": row[5],
-                "created_at": row[6],
-                "active": bool(row[7]),
-                "card_message_id": row[8],
-            }
+    async def _warm_completion_counts(self):
+        async with self._read() as db:
+            # все задания, в том числе без выполнений: иначе их счётчик заполнится промахом
+            cur = await db.execute(
+                """
+                SELECT t.id, COALESCE(c.n, 0) + COALESCE(tt.completions, 0)
+                FROM tasks t
+                LEFT JOIN (SELECT task_id, COUNT(*) AS n FROM completions GROUP BY task_id) c ON c.task_id = t.id
+                LEFT JOIN task_totals tt ON tt.task_id = t.id
+                """
+            )
+            rows = await cur.fetchall()
+            await cur.close()
+        self._completion_counts = {int(r[0]): int(r[1]) for r in rows}
 
-    async def count_completions(self, task_id: int) -> int:
-        async with aiosqlite.connect(self.path) as db:
+    async def check_completion_counts(self, task_ids: Optional[list[int]] = None) -> dict[int, tuple[int, int]]:
+        """
+        Сверяет счётчики в памяти с таблицами (completions + task_totals) и чинит расхождения.
+        Возвращает {task_id: (было_в_памяти, в_таблице)} для несовпавших.
+        """
+        if task_ids is None:
+            task_ids = list(self._completion_counts)
+
+        mismatches = {}
+        for task_id in task_ids:
+            # под блокировкой записи, как и промах в count_completions
+            async with self._write_lock:
+                actual = await self._count_completions_db(task_id)
+                cached = self._completion_counts.get(task_id)
+                if cached is not None and cached != actual:
+                    mismatches[task_id] = (cached, actual)
+                self._completion_counts[task_id] = actual
+        return mismatches
+
+    async def add_completion(self, chat_id: int, task_id: int, user_id: int, ts: int) -> bool:
+        return await self._enqueue_completion("add", chat_id, task_id, user_id, ts)
+
+    async def remove_completion(self, chat_id: int, task_id: int, user_id: int) -> bool:
+        return await self._enqueue_completion("remove", chat_id, task_id, user_id, 0)
+
+    # ====== пакетная запись completions (group commit) ======
+
+    async def _enqueue_completion(self, op: str, chat_id: int, task_id: int, user_id: int, ts: int) -> bool:
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((op, chat_id, task_id, user_id, ts, fut))
+        self._batch_ready.set()
+        if len(self._pending) >= self.batch_max_ops:
+            self._batch_full.set()
+        return await fut
+
+    async def _flush_loop(self):
+        while not self._closing:
+            await self._batch_ready.wait()
+            if len(self._pending) < self.batch_max_ops:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.batch_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch, self._pending = self._pending, []
+            self._batch_ready.clear()
+            self._batch_full.clear()
+            if batch:
+                await self._flush_completions(batch)
+
+    async def _flush_completions(self, batch: list[tuple[str, int, int, int, int, asyncio.Future]]):
+        results = []
+        touched: set[tuple[int, str, int]] = set()
+        try:
+            async with self._write() as db:
+                for op, chat_id, task_id, user_id, ts, _ in batch:
+                    if op == "add":
+                        cur = await db.execute(
+                            "INSERT OR IGNORE INTO completions(task_id, user_id, completed_at) VALUES(?, ?, ?)",
+                            (task_id, user_id, ts),
+                        )
+                        changed = cur.rowcount > 0
+                        await cur.close()
+                        if changed:
+                            touched.update(await self._bump_leaderboard(db, chat_id, user_id, ts, +1))
+                    else:
+                        cur = await db.execute(
+                            "DELETE FROM completions WHERE task_id = ? AND user_id = ? RETURNING completed_at",
+                            (task_id, user_id),
+                        )
+                        row = await cur.fetchone()
+                        await cur.close()
+                        changed = row is not None
+                        if changed:
+                            touched.update(await self._bump_leaderboard(db, chat_id, user_id, row[0], -1))
+                    results.append(changed)
+                await db.commit()
+                # ещё под блокировкой: промах count_completions прочитает таблицу
+                # либо до этой пачки, либо вместе с ней и с обновлённым кэшем
+                for (op, _, task_id, *_), result in zip(batch, results):
+                    if result and task_id in self._completion_counts:
+                        self._completion_counts[task_id] += 1 if op == "add" else -1
+        except Exception as e:
+            for *_, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+
+        if touched:
+            self._leaderboard_seq += 1
+            for key in touched:
+                self._leaderboard_versions[key] = self._leaderboard_seq
+
+        for (*_, fut), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    async def user_stats(self, chat_id: int, user_id: int, now_ts: int) -> dict:
+        """
+        Всё для "Мой прогресс" одним запросом: выполнения за неделю и месяц
+        (из leaderboard), созданные за неделю задания и место в топе недели.
+        """
+        tz = self.tz_for(chat_id)
+        w_start, w_end = period_bounds("week", now_ts, tz)
+        m_start, _ = period_bounds("month", now_ts, tz)
+        async with self._read() as db:
             cur = await db.execute(
-                "SELECT COUNT(*) FROM completions WHERE task_id = ?",
-                (task_id,),
+                """
+                WITH me AS (
+                    SELECT
+                        (SELECT completions FROM leaderboard
+                         WHERE chat_id = :chat_id AND period = 'week'
+                           AND period_start = :w_start AND user_id = :user_id) AS done_week,
+                        (SELECT completions FROM leaderboard
+                         WHERE chat_id = :chat_id AND period = 'month'
+                           AND period_start = :m_start AND user_id = :user_id) AS done_month
+                )
+                SELECT
+                    me.done_week,
+                    me.done_month,
+                    (SELECT COUNT(*) FROM tasks
+                     WHERE chat_id = :chat_id AND created_by = :user_id
+                       AND created_at BETWEEN :w_start AND :w_end),
+                    CASE WHEN me.done_week IS NULL THEN NULL ELSE
+                        (SELECT COUNT(*) + 1 FROM leaderboard
+                         WHERE chat_id = :chat_id AND period = 'week'
+                           AND period_start = :w_start AND completions > me.done_week)
+                    END
+                FROM me
+                """,
+                {"chat_id": chat_id, "user_id": user_id, "w_start": w_start, "w_end": w_end, "m_start": m_start},
             )
             row = await cur.fetchone()
             await cur.close()
-            return int(row[0])
+        return {
+            "done_week": int(row[0] or 0),
+            "done_month": int(row[1] or 0),
+            "created_week": int(row[2]),
+            "week_rank": int(row[3]) if row[3] is not None else None,
+        }
 
-    async def add_completion(self, task_id: int, user_id: int, ts: int) -> bool:
-        async with aiosqlite.connect(self.path) as db:
-            try:
+    # ====== материализованные топы (leaderboard) ======
+
+    def _period_start(self, period: str, ts: int, chat_id: int) -> int:
+        return period_bounds(period, ts, self.tz_for(chat_id))[0]
+
+    async def _bump_leaderboard(
+        self, db: aiosqlite.Connection, chat_id: int, user_id: int, ts: int, delta: int
+    ) -> list[tuple[int, str, int]]:
+        touched = []
+        for period in PERIODS:
+            key = (chat_id, period, self._period_start(period, ts, chat_id), user_id)
+            touched.append(key[:3])
+            await db.execute(
+                """
+                INSERT INTO leaderboard(chat_id, period, period_start, user_id, completions)
+                VALUES(?, ?, ?, ?, ?)
+                ON CONFLICT(chat_id, period, period_start, user_id)
+                DO UPDATE SET completions = completions + excluded.completions
+                """,
+                (*key, delta),
+            )
+            if delta < 0:
                 await db.execute(
-                    "INSERT INTO completions(task_id, user_id, completed_at) VALUES(?, ?, ?)",
-                    (task_id, user_id, ts),
+                    """
+                    DELETE FROM leaderboard
+                    WHERE chat_id = ? AND period = ? AND period_start = ? AND user_id = ? AND completions <= 0
+                    """,
+                    key,
                 )
-                await db.commit()
-                return True
-            except aiosqlite.IntegrityError:
-                return False
+        return touched
+
+    async def leaderboard_version(self, chat_id: int, period: str, period_start: int) -> int:
+        # корутина, хотя читает только память: в режиме воркеров (workers.py) это вызов в главный процесс
+        return max(
+            self._leaderboard_versions.get((chat_id, period, period_start), 0),
+            self._leaderboard_rebuilt,
+        )
 
-    async def remove_completion(self, task_id: int, user_id: int) -> bool:
-        async with aiosqlite.connect(self.path) as db:
+    async def top_in_period(
+        self, chat_id: int, period: str, period_start: int, limit: int = 20
+    ) -> list[tuple[int, int]]:
+        async with self._read() as db:
             cur = await db.execute(
-                "DELETE FROM completions WHERE task_id = ? AND user_id = ?",
-                (task_id, user_id),
+                """
+                SELECT user_id, completions
+                FROM leaderboard
+                WHERE chat_id = ? AND period = ? AND period_start = ?
+                ORDER BY completions DESC, user_id
+                LIMIT ?
+                """,
+                (chat_id, period, period_start, limit),
             )
-            await db.commit()
-            return cur.rowcount > 0
+            rows = await cur.fetchall()
+            await cur.close()
+            return [(int(r[0]), int(r[1])) for r in rows]
 
-    async def count_user_completions_in_range(self, user_id: int, start_ts: int, end_ts: int) -> int:
-        async with aiosqlite.connect(self.path) as db:
+    async def _leaderboard_needs_backfill(self) -> bool:
+        async with self._read() as db:
             cur = await db.execute(
                 """
-                SELECT COUNT(*) FROM completions
-                WHERE user_id = ? AND completed_at BETWEEN ? AND ?
-                """,
-                (user_id, start_ts, end_ts),
+                SELECT EXISTS(SELECT 1 FROM completions)
+                   AND NOT EXISTS(SELECT 1 FROM leaderboard)
+                """
             )
             row = await cur.fetchone()
             await cur.close()
-            return int(row[0])
+            return bool(row[0])
 
-    async def top_completions_in_range(self, start_ts: int, end_ts: int, limit: int = 20):
-        async with aiosqlite.connect(self.path) as db:
+    async def rebuild_leaderboards(self):
+        """
+        Пересобирает leaderboard из completions. Периоды, начавшиеся раньше отметки
+        сжатия чата, не трогаем: сырых данных за них уже нет (месяцы — из completion_months).
+        """
+        async with self._write() as db:
+            await db.execute(
+                """
+                DELETE FROM leaderboard
+                WHERE period_start >= COALESCE(
+                    (SELECT compacted_before FROM compactions WHERE chat_id = leaderboard.chat_id), 0)
+                """
+            )
+            for period in PERIODS:
+                await db.execute(
+                    """
+                    INSERT INTO leaderboard(chat_id, period, period_start, user_id, completions)
+                    SELECT t.chat_id, ?, period_start(?, c.completed_at, t.chat_id) AS ps, c.user_id, COUNT(*)
+                    FROM completions c
+                    JOIN tasks t ON t.id = c.task_id
+                    WHERE period_start(?, c.completed_at, t.chat_id) >= COALESCE(
+                        (SELECT compacted_before FROM compactions WHERE chat_id = t.chat_id), 0)
+                    GROUP BY t.chat_id, ps, c.user_id
+                    """,
+                    (period, period, period),
+                )
+            await db.execute(
+                """
+                INSERT OR IGNORE INTO leaderboard(chat_id, period, period_start, user_id, completions)
+                SELECT chat_id, 'month', month_start, user_id, completions FROM completion_months WHERE true
+                """
+            )
+            await db.commit()
+        self._leaderboard_seq += 1
+        self._leaderboard_rebuilt = self._leaderboard_seq
+
+    # ====== сжатие истории completions ======
+
+    def compaction_cutoff(self, chat_id: int, now_ts: int) -> int:
+        """
+        Начало месяца, в котором началась текущая неделя: всё раньше — закрытые месяцы,
+        которые не нужны ни топу недели, ни топу месяца.
+        """
+        tz = self.tz_for(chat_id)
+        week_start, _ = week_range_msk(now_ts, tz)
+        month_start, _ = month_range_msk(week_start, tz)
+        return month_start
+
+    async def compact_completions(
+        self, now_ts: int, archive_path: Optional[str] = None, batch_size: int = 5000
+    ) -> dict[int, int]:
+        """
+        Переносит completions закрытых месяцев в сводки: completion_months (пользователь × месяц)
+        и task_totals (всего по заданию), после чего удаляет сырые строки. Если задан archive_path,
+        строки (и их задания) сначала копируются в этот отдельный файл SQLite.
+        Счётчики карточек и топы не меняются. Пишет пачками по batch_size строк,
+        отпуская writer между ними, так что бот может работать параллельно.
+        Возвращает {chat_id: сколько строк сжато}.
+        """
+        async with self._read() as db:
+            cur = await db.execute("SELECT DISTINCT chat_id FROM tasks")
+            chat_ids = [int(r[0]) for r in await cur.fetchall()]
+            await cur.close()
+
+        if archive_path:
+            async with self._write() as db:
+                await db.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+                await db.executescript(ARCHIVE_SCHEMA)
+        try:
+            done = {}
+            for chat_id in chat_ids:
+                cutoff = self.compaction_cutoff(chat_id, now_ts)
+                done[chat_id] = 0
+                while True:
+                    moved = await self._compact_batch(chat_id, cutoff, bool(archive_path), batch_size)
+                    done[chat_id] += moved
+                    if moved < batch_size:
+                        break
+                    await asyncio.sleep(0)
+                async with self._write() as db:
+                    await db.execute(
+                        """
+                        INSERT INTO compactions(chat_id, compacted_before) VALUES(?, ?)
+                        ON CONFLICT(chat_id) DO UPDATE
+                        SET compacted_before = MAX(compacted_before, excluded.compacted_before)
+                        """,
+                        (chat_id, cutoff),
+                    )
+                    await db.commit()
+            return done
+        finally:
+            if archive_path:
+                async with self._write() as db:
+                    await db.execute("DETACH DATABASE archive")
+
+    async def _compact_batch(self, chat_id: int, cutoff: int, archive: bool, batch_size: int) -> int:
+        async with self._write() as db:
+            await db.execute("CREATE TEMP TABLE IF NOT EXISTS compact_batch(row_id INTEGER PRIMARY KEY)")
+            await db.execute("DELETE FROM compact_batch")
             cur = await db.execute(
                 """
-                SELECT user_id, COUNT(*) as c
-                FROM completions
-                WHERE completed_at BETWEEN ? AND ?
-                GROUP BY user_id
-                ORDER BY c DESC
+                INSERT INTO compact_batch(row_id)
+                SELECT c.rowid FROM completions c
+                JOIN tasks t ON t.id = c.task_id
+                WHERE c.completed_at < ? AND t.chat_id = ?
                 LIMIT ?
                 """,
-                (start_ts, end_ts, limit),
+                (cutoff, chat_id, batch_size),
             )
-            rows = await cur.fetchall()
+            moved = cur.rowcount
             await cur.close()
-            return [(int(r[0]), int(r[1])) for r in rows]
+            if not moved:
+                await db.commit()
+                return 0
+
+            if archive:
+                await db.execute(
+                    """
+                    INSERT OR REPLACE INTO archive.tasks(
+                        id, chat_id, topic_id, created_by, post_url, post_key, created_at, active, card_message_id)
+                    SELECT id, chat_id, topic_id, created_by, post_url, post_key, created_at, active, card_message_id
+                    FROM tasks WHERE id IN (
+                        SELECT c.task_id FROM completions c WHERE c.rowid IN (SELECT row_id FROM compact_batch))
+                    """
+                )
+                await db.execute(
+                    """
+                    INSERT OR IGNORE INTO archive.completions(chat_id, task_id, user_id, completed_at)
+                    SELECT ?, task_id, user_id, completed_at FROM completions
+                    WHERE rowid IN (SELECT row_id FROM compact_batch)
+                    """,
+                    (chat_id,),
+                )
+            await db.execute(
+                """
+                INSERT INTO completion_months(chat_id, month_start, user_id, completions)
+                SELECT ?, period_start('month', completed_at, ?) AS ms, user_id, COUNT(*)
+                FROM completions WHERE rowid IN (SELECT row_id FROM compact_batch)
+                GROUP BY ms, user_id
+                ON CONFLICT(chat_id, month_start, user_id)
+                DO UPDATE SET completions = completions + excluded.completions
+                """,
+                (chat_id, chat_id),
+            )
+            await db.execute(
+                """
+                INSERT INTO task_totals(task_id, completions)
+                SELECT task_id, COUNT(*) FROM completions
+                WHERE rowid IN (SELECT row_id FROM compact_batch)
+                GROUP BY task_id
+                ON CONFLICT(task_id) DO UPDATE SET completions = completions + excluded.completions
+                """
+            )
+            await db.execute("DELETE FROM completions WHERE rowid IN (SELECT row_id FROM compact_batch)")
+            await db.commit()
+        return moved
+
+    # ====== выгрузка (см. export.py) ======
+
+    async def iter_completions(
+        self, chat_id: int, start_ts: int, end_ts: int, batch_size: int = 1000
+    ) -> AsyncIterator[list[Completion]]:
+        """
+        Выполнения заданий чата с completed_at в [start_ts, end_ts] по времени
+        выполнения, пачками по batch_size строк.
+        Строки идут из курсора по мере чтения, в памяти — только текущая пачка.
+        Читает отдельным соединением: долгая выгрузка не занимает пул читателей бота
+        и вся идёт по одному снимку базы. Сжатые месяцы (compact) сюда не попадают.
+        """
+        conn = await self._connect()
+        try:
+            cur = await conn.execute(SELECT_COMPLETIONS_EXPORT, (start_ts, end_ts, chat_id))
+            cur.row_factory = Completion.from_row
+            while rows := await cur.fetchmany(batch_size):
+                yield rows
+            await cur.close()
+        finally:
+            await conn.close()
 
     # ====== bot_messages (для чистки старых "топов/правил/стат") ======
 
     async def get_last_bot_message_id(self, chat_id: int, topic_id: int, kind: str) -> Optional[int]:
-        async with aiosqlite.connect(self.path) as db:
+        async with self._read() as db:
             cur = await db.execute(
                 """
                 SELECT message_id FROM bot_messages
@@ -238,7 +1186,7 @@ class Database:
             return int(row[0]) if row else None
 
     async def set_last_bot_message_id(self, chat_id: int, topic_id: int, kind: str, message_id: int, created_at: int):
-        async with aiosqlite.connect(self.path) as db:
+        async with self._write() as db:
             await db.execute(
                 """
                 INSERT INTO bot_messages(chat_id, topic_id, kind, message_id, created_at)
@@ -248,4 +1196,85 @@ class Database:
                 """,
                 (chat_id, topic_id, kind, message_id, created_at),
             )
-            await db.commit()
\ No newline at end of file
+            await db.commit()
+
+    # ====== users (кэш имён для топов) ======
+
+    async def get_user_names(self, user_ids: list[int]) -> dict[int, tuple[str, int]]:
+        if not user_ids:
+            return {}
+        async with self._read() as db:
+            cur = await db.execute(SELECT_USER_NAMES, (json.dumps(user_ids),))
+            rows = await cur.fetchall()
+            await cur.close()
+            return {int(r[0]): (r[1], int(r[2])) for r in rows}
+
+    async def save_user_names(self, rows: list[tuple[int, str, int]]):
+        if not rows:
+            return
+        async with self._write() as db:
+            await db.executemany(
+                """
+                INSERT INTO users(user_id, name, updated_at)
+                VALUES(?, ?, ?)
+                ON CONFLICT(user_id)
+                DO UPDATE SET name=excluded.name, updated_at=excluded.updated_at
+                """,
+                rows,
+            )
+            await db.commit()
+
+    # ====== scheduled_deletions (отложенное удаление сообщений) ======
+
+    async def add_scheduled_deletion(self, chat_id: int, message_id: int, delete_at: int):
+        async with self._write() as db:
+            await db.execute(
+                """
+                INSERT INTO scheduled_deletions(chat_id, message_id, delete_at)
+                VALUES(?, ?, ?)
+                ON CONFLICT(chat_id, message_id) DO UPDATE SET delete_at=excluded.delete_at
+                """,
+                (chat_id, message_id, delete_at),
+            )
+            await db.commit()
+
+    async def get_scheduled_deletions(self) -> list[tuple[int, int, int]]:
+        async with self._read() as db:
+            cur = await db.execute("SELECT chat_id, message_id, delete_at FROM scheduled_deletions")
+            rows = await cur.fetchall()
+            await cur.close()
+            return [(int(r[0]), int(r[1]), int(r[2])) for r in rows]
+
+    async def remove_scheduled_deletions(self, items: list[tuple[int, int]]):
+        if not items:
+            return
+        async with self._write() as db:
+            await db.executemany(
+                "DELETE FROM scheduled_deletions WHERE chat_id = ? AND message_id = ?",
+                items,
+            )
+            await db.commit()
+
+
+async def _fetchone(db: aiosqlite.Connection, record, sql: str, params=()):
+    """Одна строка запроса как record (Task/Completion/Ban) или None."""
+    cur = await db.execute(sql, params)
+    cur.row_factory = record.from_row
+    row = await cur.fetchone()
+    await cur.close()
+    return row
+
+
+async def _fetchall(db: aiosqlite.Connection, record, sql: str, params=()) -> list:
+    cur = await db.execute(sql, params)
+    cur.row_factory = record.from_row
+    rows = await cur.fetchall()
+    await cur.close()
+    return rows
+
+
+async def _optimize_quietly(conn: aiosqlite.Connection):
+    try:
+        await conn.execute("PRAGMA optimize")
+    except Exception:
+        log.exception("PRAGMA optimize failed")
@@ -0,0 +1,182 @@
+"""
+Выгрузка выполнений заданий (completions × tasks) в CSV или JSONL, сжатые gzip.
+
+Конвейер из асинхронных генераторов: пачки выполнений из курсора базы
+(Database.iter_completions) -> задания (get_tasks) и имена из кэша users ->
+строки CSV/JSONL ->
+куски gzip -> файл. В памяти одновременно не больше одной пачки, сколько бы
+строк ни было в выгрузке; база читается в своём потоке aiosqlite, а между
+пачками цикл событий свободен.
+"""
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, BinaryIO, Optional
+from zoneinfo import ZoneInfo
+
+from periods import RANGES
+
+log = logging.getLogger(__name__)
+
+COLUMNS = ("completed_at", "user_id", "user_name", "task_id", "post_url", "created_by", "task_created_at")
+FORMATS = ("csv", "jsonl")
+# текущие и прошлые неделя/месяц в часовом поясе чата
+PERIODS = ("week", "month", "prev-week", "prev-month")
+
+
+def export_range(period: str, now_ts: int, tz: str) -> tuple[int, int]:
+    """Границы (start, end) периода из PERIODS, оба включительно."""
+    # RANGES, а не period_bounds: не сбиваем кэш текущего периода горячего пути
+    if period.startswith("prev-"):
+        period = period[len("prev-"):]
+        start, _ = RANGES[period](now_ts, tz)
+        now_ts = start - 1
+    return RANGES[period](now_ts, tz)
+
+
+def date_range(since: str, until: Optional[str], tz: str) -> tuple[int, int]:
+    """Даты YYYY-MM-DD (until включительно, по умолчанию — сегодня) в границы (start, end)."""
+    zone = ZoneInfo(tz)
+    first = date.fromisoformat(since)
+    last = date.fromisoformat(until) if until else datetime.now(zone).date()
+    start = datetime.combine(first, datetime.min.time(), zone)
+    end = datetime.combine(last + timedelta(days=1), datetime.min.time(), zone)
+    return int(start.timestamp()), int(end.timestamp()) - 1
+
+
+async def named_rows(db, names_db, chat_id: int, start_ts: int, end_ts: int, batch_size: int):
+    """
+    Пачки строк в порядке COLUMNS. Задания (из db) и имена (из names_db) —
+    по одному запросу на пачку: в пачке обычно немного разных заданий.
+    """
+    async for batch in db.iter_completions(chat_id, start_ts, end_ts, batch_size):
+        tasks = await db.get_tasks(list({c.task_id for c in batch}))
+        names = await names_db.get_user_names(list({c.user_id for c in batch}))
+        rows = []
+        for c in batch:
+            task = tasks[c.task_id]
+            name = names.get(c.user_id, ("", 0))[0]
+            rows.append((c.completed_at, c.user_id, name, c.task_id, task.post_url, task.created_by, task.created_at))
+        yield rows
+
+
+def _iso(ts: int, zone: ZoneInfo) -> str:
+    return datetime.fromtimestamp(ts, zone).isoformat()
+
+
+async def encode_csv(batches, tz: str) -> AsyncIterator[bytes]:
+    zone = ZoneInfo(tz)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(COLUMNS)
+    async for batch in batches:
+        writer.writerows(
+            (_iso(r[0], zone), r[1], r[2], r[3], r[4], r[5], _iso(r[6], zone)) for r in batch
+        )
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+async def encode_jsonl(batches, tz: str) -> AsyncIterator[bytes]:
+    zone = ZoneInfo(tz)
+    async for batch in batches:
+        yield "".join(
+            json.dumps(
+                dict(zip(COLUMNS, (_iso(r[0], zone), r[1], r[2], r[3], r[4], r[5], _iso(r[6], zone)))),
+                ensure_ascii=False,
+            ) + "\n"
+            for r in batch
+        ).encode()
+
+
+ENCODERS = {
+    "csv": encode_csv,
+    "jsonl": encode_jsonl,
+}
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes], level: int = 6) -> AsyncIterator[bytes]:
+    """Потоковое сжатие в формат gzip (wbits=31): на выходе куски одного .gz-файла."""
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        data = z.compress(chunk)
+        if data:
+            yield data
+    yield z.flush()
+
+
+async def write_export(
+    db,
+    names_db,
+    chat_id: int,
+    start_ts: int,
+    end_ts: int,
+    fmt: str,
+    out: BinaryIO,
+    batch_size: int = 1000,
+) -> int:
+    """Пишет выгрузку в out (.csv.gz / .jsonl.gz). Возвращает число строк."""
+    rows = 0
+
+    async def counted():
+        nonlocal rows
+        async for batch in named_rows(db, names_db, chat_id, start_ts, end_ts, batch_size):
+            rows += len(batch)
+            yield batch
+
+    async for data in gzip_chunks(ENCODERS[fmt](counted(), db.tz_for(chat_id))):
+        out.write(data)
+    return rows
+
+
+class ExportService:
+    """
+    Выгрузки для команды /export: пишет файл во временный каталог и отдаёт путь.
+    Одновременно идёт не больше max_concurrent выгрузок, остальные ждут.
+    Файл удаляет тот, кто его отправил (remove).
+    """
+
+    def __init__(self, chats, main_db, directory: Optional[str] = None, batch_size: int = 1000, max_concurrent: int = 1):
+        self.chats = chats
+        self.main_db = main_db
+        self.directory = directory or tempfile.gettempdir()
+        self.batch_size = batch_size
+        self._sem = asyncio.Semaphore(max_concurrent)
+
+    async def export(self, chat_id: int, period: str, fmt: str, now: Optional[int] = None) -> tuple[str, int]:
+        """(путь к файлу, число строк)."""
+        db = self.chats.db_for(chat_id)
+        start_ts, end_ts = export_range(period, int(time.time()) if now is None else now, db.tz_for(chat_id))
+        async with self._sem:
+            started = time.perf_counter()
+            fd, path = tempfile.mkstemp(prefix=f"export-{chat_id}-{period}-", suffix=f".{fmt}.gz", dir=self.directory)
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    rows = await write_export(db, self.main_db, chat_id, start_ts, end_ts, fmt, out, self.batch_size)
+            except BaseException:
+                os.unlink(path)
+                raise
+        log.info("export of chat %s (%s, %s): %d row(s) in %.1f s", chat_id, period, fmt, rows, time.perf_counter() - started)
+        return path, rows
+
+    async def remove(self, path: str):
+        # только свои файлы: в режиме WORKERS путь приходит из другого процесса
+        if os.path.dirname(path) != self.directory or not os.path.basename(path).startswith("export-"):
+            raise ValueError(f"not an export file: {path}")
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    async def close(self):
+        pass
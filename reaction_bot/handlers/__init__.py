@@ -1,10 +1,13 @@
 from .debug import router as debug_router
+from .export import router as export_router
 from .tasks import router as tasks_router
 from .stats import router as stats_router
 from .welcome import router as welcome_router
 
 all_routers = [
     debug_router,
+    # до tasks: тот забирает любой текст в теме заданий
+    export_router,
     welcome_router,
     tasks_router,
     stats_router,
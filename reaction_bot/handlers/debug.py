@@ -1,7 +1,7 @@
 from aiogram import Router, F
 from aiogram.types import Message
 
-router = Router()
+router = Router(name="debug")
 
 
 @router.message(F.text == "/debug")
@@ -0,0 +1,54 @@
+import os
+
+from aiogram import Router
+from aiogram.filters import Command, CommandObject
+from aiogram.types import FSInputFile, Message
+
+from export import FORMATS, PERIODS
+
+router = Router(name="export")
+
+ADMIN_STATUSES = {"creator", "administrator"}
+# больше Bot API от бота не примет
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+USAGE = "Формат: /export [week|month|prev-week|prev-month] [csv|jsonl]"
+
+
+async def is_chat_admin(message: Message) -> bool:
+    # анонимный админ пишет от имени самого чата
+    if message.sender_chat is not None:
+        return message.sender_chat.id == message.chat.id
+    member = await message.bot.get_chat_member(message.chat.id, message.from_user.id)
+    return member.status in ADMIN_STATUSES
+
+
+@router.message(Command("export"))
+async def on_export(message: Message, command: CommandObject, chat_settings, exports):
+    if chat_settings is None:
+        return
+    if not await is_chat_admin(message):
+        await message.reply("Выгрузка доступна только администраторам чата.")
+        return
+
+    args = (command.args or "").lower().split()
+    if any(a not in PERIODS and a not in FORMATS for a in args):
+        await message.reply(USAGE)
+        return
+    period = next((a for a in args if a in PERIODS), "month")
+    fmt = next((a for a in args if a in FORMATS), "csv")
+
+    path, rows = await exports.export(message.chat.id, period, fmt)
+    try:
+        if os.path.getsize(path) > MAX_DOCUMENT_SIZE:
+            await message.reply(
+                f"Выгрузка ({rows} строк) больше 50 МБ — Telegram её не примет. "
+                f"Её можно снять на сервере: python manage.py export --chat-id {message.chat.id} --period {period}"
+            )
+            return
+        await message.reply_document(
+            FSInputFile(path, filename=f"export-{message.chat.id}-{period}.{fmt}.gz"),
+            caption=f"Выполнения заданий ({period}): {rows} строк.",
+        )
+    finally:
+        await exports.remove(path)
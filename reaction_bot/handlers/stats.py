@@ -1,22 +1,24 @@
 import time
-import asyncio
 
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
 from aiogram.exceptions import TelegramBadRequest
 
-from utils import week_range_msk, month_range_msk, display_name
+from utils import display_name, tz_label
 from keyboards import simple_kb
+from periods import period_bounds
 
-router = Router()
+router = Router(name="stats")
 
 
-async def send_clean_ephemeral(call: CallbackQuery, config, db, kind: str, text: str, seconds: int = 30):
+async def send_clean_ephemeral(
+    call: CallbackQuery, config, db, deletions, kind: str, text: str, seconds: int = 30
+):
     """
     1) Удаляет предыдущее сообщение бота этого kind (если известно).
     2) Отправляет новое.
     3) Запоминает message_id в БД.
-    4) Удаляет новое через seconds.
+    4) Ставит новое в очередь на удаление через seconds.
     """
     chat_id = call.message.chat.id
     topic_id = call.message.message_thread_id
@@ -38,87 +40,89 @@ async def send_clean_ephemeral(call: CallbackQuery, config, db, kind: str, text:
     await db.set_last_bot_message_id(chat_id, topic_id, kind, msg.message_id, now)
 
     # 4) автоудаление
-    await asyncio.sleep(seconds)
-    try:
-        await msg.delete()
-    except TelegramBadRequest:
-        pass
+    await deletions.schedule(chat_id, msg.message_id, seconds)
+
+
+async def reject_unknown_chat(call: CallbackQuery, chat_settings) -> bool:
+    if chat_settings is None:
+        await call.answer("Бот не работает в этом чате.", show_alert=True)
+        return True
+    return False
 
 
 @router.callback_query(F.data == "rules")
-async def on_rules(call: CallbackQuery, config, db):
+async def on_rules(call: CallbackQuery, config, db, chat_settings, deletions):
+    if await reject_unknown_chat(call, chat_settings):
+        return
+    tz = tz_label(chat_settings.tz)
     await send_clean_ephemeral(
-        call, config, db, "rules",
+        call, config, db, deletions, "rules",
         "Правила:\n"
         "1) В этой теме кидаем ссылку на пост в канале — бот создаёт задание.\n"
         "2) Поставил(а) реакцию на пост — нажми «✅ Поставил(а) реакцию».\n"
         "3) 1 человек = 1 зачёт на 1 задание.\n"
-        "4) Лимит создания: 10 заданий в неделю (МСК).\n"
+        f"4) Лимит создания: {chat_settings.weekly_task_limit} заданий в неделю ({tz}).\n"
         "5) Задания прошлой недели не засчитываются, если началась новая.",
         seconds=30,
     )
 
 
 @router.callback_query(F.data == "me")
-async def on_me(call: CallbackQuery, config, db):
+async def on_me(call: CallbackQuery, config, db, chat_settings, deletions):
+    if await reject_unknown_chat(call, chat_settings):
+        return
     now = int(time.time())
 
-    w_start, w_end = week_range_msk(now, config.tz)
-    m_start, m_end = month_range_msk(now, config.tz)
-
-    done_week = await db.count_user_completions_in_range(call.from_user.id, w_start, w_end)
-    created_week = await db.count_user_tasks_in_range(call.from_user.id, w_start, w_end)
-    done_month = await db.count_user_completions_in_range(call.from_user.id, m_start, m_end)
+    stats = await db.user_stats(call.message.chat.id, call.from_user.id, now)
+    rank_line = f"🏆 Место в топе недели: {stats['week_rank']}\n" if stats["week_rank"] else ""
+    tz = tz_label(chat_settings.tz)
 
     await send_clean_ephemeral(
-        call, config, db, "me",
+        call, config, db, deletions, "me",
         f"{display_name(call.from_user)} — статистика:\n"
-        f"Неделя (МСК):\n"
-        f"✅ Выполнено: {done_week}\n"
-        f"📝 Создано заданий: {created_week}/{config.weekly_task_limit}\n\n"
-        f"Месяц (МСК):\n"
-        f"✅ Выполнено: {done_month}",
+        f"Неделя ({tz}):\n"
+        f"✅ Выполнено: {stats['done_week']}\n"
+        f"{rank_line}"
+        f"📝 Создано заданий: {stats['created_week']}/{chat_settings.weekly_task_limit}\n\n"
+        f"Месяц ({tz}):\n"
+        f"✅ Выполнено: {stats['done_month']}",
         seconds=30,
     )
 
 
-@router.callback_query(F.data == "top")
-async def on_top(call: CallbackQuery, config, db, bot):
+async def render_top(
+    call: CallbackQuery, chat_settings, db, bot, profiles, leaderboards, period: str, title: str
+) -> str:
     now = int(time.time())
-    start_ts, end_ts = week_range_msk(now, config.tz)
-    top = await db.top_completions_in_range(start_ts, end_ts, limit=20)
+    start_ts, _ = period_bounds(period, now, chat_settings.tz)
+    chat_id = call.message.chat.id
 
-    lines = ["🏆 Топ недели (МСК):"]
-    if not top:
-        lines.append("Пока пусто.")
-    else:
-        for i, (user_id, c) in enumerate(top, start=1):
-            try:
-                chat_member = await bot.get_chat_member(call.message.chat.id, user_id)
-                name = display_name(chat_member.user)
-            except Exception:
-                name = str(user_id)
-            lines.append(f"{i}. {name} — {c}")
+    async def render() -> str:
+        top = await db.top_in_period(chat_id, period, start_ts, limit=20)
 
-    await send_clean_ephemeral(call, config, db, "top", "\n".join(lines), seconds=30)
+        lines = [f"{title} ({tz_label(chat_settings.tz)}):"]
+        if not top:
+            lines.append("Пока пусто.")
+        else:
+            names = await profiles.names(bot, chat_id, [user_id for user_id, _ in top])
+            for i, (user_id, c) in enumerate(top, start=1):
+                lines.append(f"{i}. {names[user_id]} — {c}")
+        return "\n".join(lines)
+
+    return await leaderboards.get(chat_id, period, start_ts, render)
+
+
+@router.callback_query(F.data == "top")
+async def on_top(call: CallbackQuery, config, db, chat_settings, bot, profiles, leaderboards, deletions):
+    if await reject_unknown_chat(call, chat_settings):
+        return
+    text = await render_top(call, chat_settings, db, bot, profiles, leaderboards, "week", "🏆 Топ недели")
+    await send_clean_ephemeral(call, config, db, deletions, "top", text, seconds=30)
 
 
 @router.callback_query(F.data == "month_top")
-async def on_month_top(call: CallbackQuery, config, db, bot):
-    now = int(time.time())
-    start_ts, end_ts = month_range_msk(now, config.tz)
-    top = await db.top_completions_in_range(start_ts, end_ts, limit=20)
-
-    lines = ["🏅 Топ месяца (МСК):"]
-    if not top:
-        lines.append("Пока пусто.")
-    else:
-        for i, (user_id, c) in enumerate(top, start=1):
-            try:
-                chat_member = await bot.get_chat_member(call.message.chat.id, user_id)
-                name = display_name(chat_member.user)
-            except Exception:
-                name = str(user_id)
-            lines.append(f"{i}. {name} — {c}")
-
-    await send_clean_ephemeral(call, config, db, "month_top", "\n".join(lines), seconds=30)
\ No newline at end of file
+async def on_month_top(call: CallbackQuery, config, db, chat_settings, bot, profiles, leaderboards, deletions):
+    if await reject_unknown_chat(call, chat_settings):
+        return
+    text = await render_top(call, chat_settings, db, bot, profiles, leaderboards, "month", "🏅 Топ месяца")
+    await send_clean_ephemeral(call, config, db, deletions, "month_top", text, seconds=30)
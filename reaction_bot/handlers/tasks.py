@@ -1,40 +1,43 @@
 import time
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
-from aiogram.exceptions import TelegramBadRequest
 
 from keyboards import task_kb, simple_kb
 from utils import (
-    extract_first_tme_url,
+    extract_tme_urls,
     parse_post_key,
-    week_range_msk,
     display_name,
-    is_same_week_msk,
+    tz_label,
 )
 
-router = Router()
+router = Router(name="tasks")
 
 
-def allowed_place(message: Message, chat_id: int, topic_id: int) -> bool:
-    return (message.chat.id == chat_id) and (message.message_thread_id == topic_id)
+def allowed_place(message: Message, chat_settings) -> bool:
+    return chat_settings is not None and (message.message_thread_id == chat_settings.topic_id)
 
 
-def allowed_place_cb(call: CallbackQuery, chat_id: int, topic_id: int) -> bool:
+def allowed_place_cb(call: CallbackQuery, chat_settings) -> bool:
     msg = call.message
-    return msg and (msg.chat.id == chat_id) and (msg.message_thread_id == topic_id)
+    return msg and chat_settings is not None and (msg.message_thread_id == chat_settings.topic_id)
 
 
 @router.message(F.text)
-async def on_message_with_link(message: Message, config, db):
-    if not allowed_place(message, config.chat_id, config.topic_id):
+async def on_message_with_link(message: Message, db, main_db, chat_settings, periods):
+    if not allowed_place(message, chat_settings):
         return
 
-    url = extract_first_tme_url(message.text)
-    if not url:
+    urls = extract_tme_urls(message.text)
+    if not urls:
         return
 
-    post_key = parse_post_key(url)
-    if not post_key:
+    # одна и та же публикация может встретиться в разных написаниях ссылки
+    links = {}
+    for url in urls:
+        post_key = parse_post_key(url)
+        if post_key and post_key not in links:
+            links[post_key] = url
+    if not links:
         await message.reply(
             "Не понял ссылку. Нужна ссылка вида t.me/<канал>/<id> или t.me/c/<id>/<id>.",
             reply_markup=simple_kb(),
@@ -43,112 +46,109 @@ async def on_message_with_link(message: Message, config, db):
 
     now = int(time.time())
 
-    if await db.is_banned(message.from_user.id, now):
+    if await main_db.is_banned(message.from_user.id, now):
         await message.reply(
             "Тебе сейчас нельзя отмечать выполнения/создавать задания.",
             reply_markup=simple_kb(),
         )
         return
 
-    start_ts, end_ts = week_range_msk(now, config.tz)
-    created_count = await db.count_user_tasks_in_range(message.from_user.id, start_ts, end_ts)
-    if created_count >= config.weekly_task_limit:
-        await message.reply(
-            f"Лимит: {config.weekly_task_limit} заданий в неделю (МСК).\n"
-            f"На этой неделе у тебя уже {created_count}/{config.weekly_task_limit}.",
-            reply_markup=simple_kb(),
-        )
-        return
-
-    existing = await db.get_task_by_post_key(post_key)
-    if existing and existing["active"]:
-        await message.reply(
-            f"Такое задание уже есть: #{existing['id']}.",
-            reply_markup=task_kb(existing["id"]),
-        )
-        return
-
-    task_id = await db.create_task(
+    limit = chat_settings.weekly_task_limit
+    start_ts, end_ts = periods.week(chat_settings.tz, now)
+    results, created_count = await db.create_tasks(
         chat_id=message.chat.id,
         topic_id=message.message_thread_id,
         created_by=message.from_user.id,
-        post_url=url,
-        post_key=post_key,
+        links=[(url, post_key) for post_key, url in links.items()],
         created_at=now,
+        week_start=start_ts,
+        week_end=end_ts,
+        limit=limit,
     )
 
-    text = (
-        f"Задание #{task_id}\n"
-        f"Ссылка: {url}\n"
-        f"Создал: {display_name(message.from_user)}\n"
-        f"Выполнили: 0"
-    )
-    card = await message.reply(text, reply_markup=task_kb(task_id))
-    await db.set_task_card_message_id(task_id, card.message_id)
+    cards = []
+    for r in results:
+        if r["status"] != "created":
+            continue
+        text = (
+            f"Задание #{r['task_id']}\n"
+            f"Ссылка: {r['post_url']}\n"
+            f"Создал: {display_name(message.from_user)}\n"
+            f"Выполнили: 0"
+        )
+        card = await message.reply(text, reply_markup=task_kb(r["task_id"]))
+        cards.append((r["task_id"], card.message_id))
+    await db.set_task_card_message_ids(cards)
+
+    # всё, что не создалось, — одним ответом
+    notes = []
+    for r in results:
+        if r["status"] == "exists":
+            notes.append(f"Такое задание уже есть: #{r['task_id']}.")
+        elif r["status"] == "closed":
+            notes.append(f"Этот пост уже был заданием #{r['task_id']} на одной из прошлых недель.")
+    skipped = sum(r["status"] == "limit" for r in results)
+    if skipped:
+        notes.append(
+            f"Лимит: {limit} заданий в неделю ({tz_label(chat_settings.tz)}).\n"
+            f"На этой неделе у тебя уже {created_count}/{limit}."
+            + (f" Не создано: {skipped}." if len(results) > 1 else "")
+        )
+    if notes:
+        existing = [r["task_id"] for r in results if r["status"] == "exists"]
+        kb = task_kb(existing[0]) if len(existing) == 1 and len(notes) == 1 else simple_kb()
+        await message.reply("\n".join(notes), reply_markup=kb)
 
 
 @router.callback_query(F.data.startswith("done:"))
-async def on_done(call: CallbackQuery, config, db):
-    if not allowed_place_cb(call, config.chat_id, config.topic_id):
+async def on_done(call: CallbackQuery, db, main_db, chat_settings, cards, periods):
+    if not allowed_place_cb(call, chat_settings):
         await call.answer("Кнопки работают только в нужной теме.", show_alert=True)
         return
 
     task_id = int(call.data.split(":")[1])
     now = int(time.time())
 
-    if await db.is_banned(call.from_user.id, now):
+    if await main_db.is_banned(call.from_user.id, now):
         await call.answer("Тебе сейчас нельзя участвовать.", show_alert=True)
         return
 
-    task = await db.get_task(task_id)
-    if not task or not task["active"]:
+    # активные задания db держит в памяти: до add_completion база не читается
+    task = await db.active_task(task_id)
+    if task is None or task[0] != call.message.chat.id:
         await call.answer("Задание не найдено или отключено.", show_alert=True)
         return
+    chat_id, created_at = task
 
-    # В зачёт не идут задания прошлой недели
-    if not is_same_week_msk(task["created_at"], now, config.tz):
+    # В зачёт не идут задания прошлой недели (active снимается на смене недели,
+    # а до того отсекаем по закэшированной границе)
+    week_start, _ = periods.week(chat_settings.tz, now)
+    if created_at < week_start:
         await call.answer("Это задание из прошлой недели. В зачёт не идёт.", show_alert=True)
         return
 
-    inserted = await db.add_completion(task_id, call.from_user.id, now)
-    count = await db.count_completions(task_id)
-
-    try:
-        await call.message.edit_text(
-            f"Задание #{task_id}\n"
-            f"Ссылка: {task['post_url']}\n"
-            f"Выполнили: {count}",
-            reply_markup=task_kb(task_id),
-        )
-    except TelegramBadRequest:
-        pass
-
+    inserted = await db.add_completion(chat_id, task_id, call.from_user.id, now)
     await call.answer("Засчитано." if inserted else "Уже было засчитано.", show_alert=False)
 
+    # карточку правим отложенно и не чаще раза в окно
+    if inserted:
+        cards.schedule(call.message.chat.id, call.message.message_id, task_id)
+
 
 @router.callback_query(F.data.startswith("undo:"))
-async def on_undo(call: CallbackQuery, config, db):
-    if not allowed_place_cb(call, config.chat_id, config.topic_id):
+async def on_undo(call: CallbackQuery, db, chat_settings, cards):
+    if not allowed_place_cb(call, chat_settings):
         await call.answer("Кнопки работают только в нужной теме.", show_alert=True)
         return
 
     task_id = int(call.data.split(":")[1])
-    task = await db.get_task(task_id)
-    if not task or not task["active"]:
+    task = await db.active_task(task_id)
+    if task is None or task[0] != call.message.chat.id:
         await call.answer("Задание не найдено или отключено.", show_alert=True)
         return
 
-    removed = await db.remove_completion(task_id, call.from_user.id)
-    count = await db.count_completions(task_id)
-
-    try:
-        await call.message.edit_text(
-            f"Задание #{task_id}\n"
-            f"Ссылка: {task['post_url']}\n"
-            f"Выполнили: {count}",
-            reply_markup=task_kb(task_id),
-        )
-    except TelegramBadRequest:
-        pass
+    removed = await db.remove_completion(task[0], task_id, call.from_user.id)
+    await call.answer("Отменено." if removed else "У тебя не было зачёта.", show_alert=False)
 
-    await call.answer("Отменено." if removed else "У тебя не было зачёта.", show_alert=False)
\ No newline at end of file
+    if removed:
+        cards.schedule(call.message.chat.id, call.message.message_id, task_id)
\ No newline at end of file
@@ -0,0 +1,65 @@
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+
+class LeaderboardCache:
+    """
+    Готовый текст топов по ключу (chat_id, period, period_start).
+    Запись живёт, пока в этом периоде не менялись completions; после изменения
+    её ещё можно отдавать не дольше max_staleness секунд.
+    Одновременные промахи по одному ключу ждут одну общую отрисовку.
+    """
+
+    def __init__(self, chats, max_staleness: float = 10.0):
+        self.chats = chats
+        self.max_staleness = max_staleness
+
+        # ключ -> (текст, версия периода, когда отрисован)
+        self._entries: dict[tuple[int, str, int], tuple[str, int, float]] = {}
+        self._rendering: dict[tuple[int, str, int], asyncio.Future] = {}
+
+    async def get(
+        self,
+        chat_id: int,
+        period: str,
+        period_start: int,
+        render: Callable[[], Awaitable[str]],
+    ) -> str:
+        key = (chat_id, period, period_start)
+        version = await self.chats.db_for(chat_id).leaderboard_version(chat_id, period, period_start)
+
+        entry = self._entries.get(key)
+        if entry:
+            text, entry_version, rendered_at = entry
+            if entry_version == version or time.monotonic() - rendered_at <= self.max_staleness:
+                return text
+
+        pending = self._rendering.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._rendering[key] = fut
+        try:
+            text = await render()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+            # исключение уже получил этот вызов; ожидающих может и не быть
+            fut.exception()
+            raise
+        else:
+            self._entries[key] = (text, version, time.monotonic())
+            fut.set_result(text)
+            self._drop_old_periods(key)
+            return text
+        finally:
+            self._rendering.pop(key, None)
+
+    def _drop_old_periods(self, fresh_key: tuple[int, str, int]):
+        chat_id, period, period_start = fresh_key
+        for key in [k for k in self._entries if k[:2] == (chat_id, period) and k[2] < period_start]:
+            del self._entries[key]
@@ -1,35 +1,192 @@
-import asyncio
 import logging
+from typing import Optional
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
-from config import load_config
+from cards import CardRefresher
+from chats import ChatMiddleware, ChatRegistry
+from config import Config, load_config
 from db import Database
+from export import ExportService
 from handlers import all_routers
+from leaderboards import LeaderboardCache
+from maintenance import DbMaintenance
+from metrics import (
+    ApiMetricsMiddleware,
+    HandlerMetricsMiddleware,
+    Metrics,
+    UpdateMetricsMiddleware,
+    instrument_database,
+    start_metrics_server,
+)
+from periods import PeriodService
+from profiles import ProfileCache, ProfileMiddleware
+from runtime import make_session, run
+from scheduler import DeletionScheduler
+from throttling import ThrottlingMiddleware
+from webhook import check_config, run_webhook
+from welcomes import WelcomeAggregator
+from workers import RemoteDatabase, RemoteService, RpcClient, run_workers
 
 logging.basicConfig(level=logging.INFO)
 
 
-async def main():
-    config = load_config()
-
-    db = Database(config.db_path)
+async def open_databases(config, metrics: Metrics):
+    db = Database(
+        config.db_path,
+        tz=config.tz,
+        pool_size=config.db_pool_size,
+        busy_timeout=config.db_busy_timeout,
+        batch_interval=config.db_batch_interval_ms / 1000,
+        batch_max_ops=config.db_batch_max_ops,
+        ban_refresh_interval=config.ban_refresh_interval,
+        cache_size_kb=config.db_cache_size_kb,
+        mmap_size_mb=config.db_mmap_size_mb,
+    )
     await db.init()
+    instrument_database(db, metrics)
 
-    bot = Bot(
-        token=config.bot_token,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    chats = ChatRegistry(db, config, on_open=lambda shard: instrument_database(shard, metrics))
+    await chats.start()
+    return db, chats
+
+
+async def open_services(config, bot: Bot, rpc: Optional[RpcClient] = None) -> dict:
+    """
+    Поднимает базу и сервисы; результат — workflow_data для Dispatcher.
+    rpc — в процессе-воркере (workers.py): базы и удаления тогда живут в главном
+    процессе, здесь только их заместители, а фоновые задачи не запускаются.
+    """
+    metrics = Metrics()
+    bot.session.middleware(ApiMetricsMiddleware(metrics))
+
+    if rpc is not None:
+        db = RemoteDatabase(rpc, config.db_path)
+        chats = ChatRegistry(db, config, open_database=lambda path: RemoteDatabase(rpc, path))
+        await chats.start(register_config_chat=False)
+        deletions = RemoteService(rpc, "deletions")
+        exports = RemoteService(rpc, "exports")
+    else:
+        db, chats = await open_databases(config, metrics)
+        deletions = DeletionScheduler(bot, db)
+        exports = ExportService(chats, db)
+
+    cards = CardRefresher(bot, chats, interval=config.card_edit_interval)
+    profiles = ProfileCache(
+        db,
+        ttl=config.profile_ttl,
+        max_size=config.profile_cache_size,
+        fetch_concurrency=config.profile_fetch_concurrency,
+    )
+
+    leaderboards = LeaderboardCache(chats, max_staleness=config.leaderboard_max_staleness)
+    welcomes = WelcomeAggregator(
+        bot,
+        deletions,
+        window=config.welcome_window,
+        per_minute=config.welcome_per_minute,
+        delete_after=config.welcome_delete_after,
+    )
+    periods = PeriodService(chats, cards, edits_per_minute=config.rollover_edits_per_minute)
+    maintenance = DbMaintenance(
+        chats,
+        interval=config.db_maintenance_interval,
+        checkpoint_mb=config.db_wal_checkpoint_mb,
+        truncate_mb=config.db_wal_truncate_mb,
+        quiet_seconds=config.db_quiet_seconds,
+        analyze_interval=config.db_analyze_interval,
+        vacuum_pages=config.db_vacuum_pages,
+    )
+    if rpc is None:
+        await deletions.start()
+        await periods.start()
+        await maintenance.start()
+
+    return dict(
+        config=config,
+        db=db,
+        main_db=db,
+        chats=chats,
+        cards=cards,
+        profiles=profiles,
+        leaderboards=leaderboards,
+        deletions=deletions,
+        exports=exports,
+        welcomes=welcomes,
+        periods=periods,
+        maintenance=maintenance,
+        metrics=metrics,
     )
 
+
+async def close_services(data: dict):
+    await data["maintenance"].close()
+    await data["periods"].close()
+    await data["welcomes"].close()
+    await data["exports"].close()
+    await data["deletions"].close()
+    await data["cards"].close()
+    await data["profiles"].close()
+    await data["chats"].close()
+    await data["db"].close()
+
+
+def build_dispatcher(data: dict) -> Dispatcher:
     dp = Dispatcher()
+    dp.update.outer_middleware(UpdateMetricsMiddleware(data["metrics"]))
+    dp.update.outer_middleware(ProfileMiddleware(data["profiles"]))
+    dp.update.outer_middleware(ChatMiddleware(data["chats"]))
+    config = data["config"]
+    dp.callback_query.outer_middleware(ThrottlingMiddleware(
+        rate=config.throttle_rate,
+        burst=config.throttle_burst,
+        chat_per_minute=config.throttle_chat_per_minute,
+        metrics=data["metrics"],
+    ))
+    # внутренние middleware диспетчера применяются и к хендлерам вложенных роутеров
+    handler_metrics = HandlerMetricsMiddleware(data["metrics"])
+    for observer in (dp.message, dp.callback_query, dp.chat_member):
+        observer.middleware(handler_metrics)
     for r in all_routers:
         dp.include_router(r)
+    return dp
+
+
+async def main(config: Optional[Config] = None):
+    config = config or load_config()
+    if config.mode == "webhook":
+        # до запуска сервисов и воркеров, а не когда уже всё поднято
+        check_config(config)
+
+    bot = Bot(
+        token=config.bot_token,
+        session=make_session(config),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
 
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot, config=config, db=db)
+    workflow_data = await open_services(config, bot)
+    dp = build_dispatcher(workflow_data)
+
+    metrics_server = None
+    if config.metrics_port:
+        metrics_server = await start_metrics_server(workflow_data["metrics"], config.metrics_host, config.metrics_port)
+
+    try:
+        if config.workers:
+            await run_workers(dp, bot, config, workflow_data)
+        elif config.mode == "webhook":
+            await run_webhook(dp, bot, **workflow_data)
+        else:
+            await bot.delete_webhook(drop_pending_updates=config.drop_pending_updates)
+            await dp.start_polling(bot, **workflow_data)
+    finally:
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        await close_services(workflow_data)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    config = load_config()
+    run(main(config), config.runtime_profile)
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+class DbMaintenance:
+    """
+    Фоновое обслуживание файлов SQLite всех баз (общей и отдельных баз чатов).
+    Раз в interval секунд:
+    - WAL больше checkpoint_mb — PASSIVE checkpoint (не ждёт читателей),
+      больше truncate_mb — TRUNCATE, чтобы файл -wal не рос бесконечно;
+    - если в базу не писали quiet_seconds — ANALYZE (не чаще analyze_interval)
+      и incremental_vacuum до vacuum_pages страниц.
+    Размер WAL и время каждого checkpoint пишутся в лог.
+    """
+
+    def __init__(
+        self,
+        chats,
+        interval: float = 60.0,
+        checkpoint_mb: float = 16,
+        truncate_mb: float = 64,
+        quiet_seconds: float = 30.0,
+        analyze_interval: float = 6 * 3600,
+        vacuum_pages: int = 1000,
+    ):
+        self.chats = chats
+        self.interval = interval
+        self.checkpoint_bytes = checkpoint_mb * MB
+        self.truncate_bytes = truncate_mb * MB
+        self.quiet_seconds = quiet_seconds
+        self.analyze_interval = analyze_interval
+        self.vacuum_pages = vacuum_pages
+        # путь базы -> когда последний раз делали ANALYZE (monotonic)
+        self._analyzed_at: dict[str, float] = {}
+        self._loop_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+
+    async def run_once(self):
+        for db in self.chats.databases():
+            try:
+                await self._maintain(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("%s: maintenance failed", db.path)
+
+    async def _maintain(self, db):
+        wal = db.wal_size()
+        mode = None
+        if wal >= self.truncate_bytes:
+            mode = "TRUNCATE"
+        elif wal >= self.checkpoint_bytes:
+            mode = "PASSIVE"
+        if mode is not None:
+            started = time.perf_counter()
+            busy, frames, moved = await db.checkpoint(mode)
+            log.info(
+                "%s: wal %.1f MB, %s checkpoint %d/%d frames in %.3f s%s, wal now %.1f MB",
+                db.path, wal / MB, mode, moved, frames, time.perf_counter() - started,
+                " (busy: readers still on old snapshot)" if busy else "", db.wal_size() / MB,
+            )
+
+        now = time.monotonic()
+        if now - db.last_write_at < self.quiet_seconds:
+            return
+        if now - self._analyzed_at.get(db.path, float("-inf")) >= self.analyze_interval:
+            started = time.perf_counter()
+            await db.analyze()
+            self._analyzed_at[db.path] = now
+            log.info("%s: ANALYZE in %.3f s", db.path, time.perf_counter() - started)
+        freed = await db.incremental_vacuum(self.vacuum_pages)
+        if freed:
+            log.info("%s: incremental vacuum freed %d page(s)", db.path, freed)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_once()
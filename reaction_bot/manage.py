@@ -0,0 +1,168 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from chats import ChatRegistry
+from config import load_config
+from db import Database
+from export import FORMATS, PERIODS, date_range, export_range, write_export
+from query_plans import check_query_plans
+
+
+async def rebuild_leaderboards(config, args) -> int:
+    db = Database(config.db_path, tz=config.tz)
+    await db.init()
+    chats = ChatRegistry(db, config)
+    try:
+        await chats.reload()
+        for d in chats.databases():
+            await d.rebuild_leaderboards()
+            print(f"{d.path}: leaderboard rebuilt")
+    finally:
+        await chats.close()
+        await db.close()
+    return 0
+
+
+async def add_chat(config, args) -> int:
+    db = Database(config.db_path, tz=config.tz)
+    await db.init()
+    try:
+        await db.upsert_chat(
+            args.chat_id,
+            args.topic_id,
+            args.welcome_topic_id,
+            args.limit if args.limit is not None else config.weekly_task_limit,
+            args.tz or config.tz,
+            args.db_path,
+        )
+    finally:
+        await db.close()
+    print(f"chat {args.chat_id} saved; running bot picks it up within a minute")
+    return 0
+
+
+async def compact(config, args) -> int:
+    db = Database(config.db_path, tz=config.tz)
+    await db.init()
+    chats = ChatRegistry(db, config)
+    now = int(time.time())
+    try:
+        await chats.reload()
+        for d in chats.databases():
+            archive = None if args.no_archive else os.path.splitext(d.path)[0] + ".archive.db"
+            done = await d.compact_completions(now, archive_path=archive, batch_size=args.batch)
+            for chat_id, rows in done.items():
+                before = datetime.fromtimestamp(d.compaction_cutoff(chat_id, now), ZoneInfo(d.tz_for(chat_id))).date()
+                print(f"{d.path}: chat {chat_id}: {rows} completions before {before} compacted")
+            if archive:
+                print(f"{d.path}: raw rows archived to {archive}")
+    finally:
+        await chats.close()
+        await db.close()
+    return 0
+
+
+async def vacuum(config, args) -> int:
+    db = Database(config.db_path, tz=config.tz)
+    await db.init()
+    chats = ChatRegistry(db, config)
+    try:
+        await chats.reload()
+        for d in chats.databases():
+            before = os.path.getsize(d.path)
+            await d.vacuum()
+            print(f"{d.path}: vacuumed, {before / 1024 / 1024:.1f} -> {os.path.getsize(d.path) / 1024 / 1024:.1f} MB")
+    finally:
+        await chats.close()
+        await db.close()
+    return 0
+
+
+async def export(config, args) -> int:
+    db = Database(config.db_path, tz=config.tz)
+    await db.init()
+    chats = ChatRegistry(db, config)
+    chat_id = args.chat_id if args.chat_id is not None else config.chat_id
+    try:
+        await chats.reload()
+        tz = db.tz_for(chat_id)
+        if args.since:
+            start_ts, end_ts = date_range(args.since, args.until, tz)
+            label = f"{args.since}_{args.until or 'now'}"
+        else:
+            start_ts, end_ts = export_range(args.period, int(time.time()), tz)
+            label = args.period
+        output = args.output or f"export-{chat_id}-{label}.{args.format}.gz"
+        started = time.perf_counter()
+        if output == "-":
+            rows = await write_export(chats.db_for(chat_id), db, chat_id, start_ts, end_ts, args.format,
+                                      sys.stdout.buffer, args.batch)
+        else:
+            with open(output, "wb") as out:
+                rows = await write_export(chats.db_for(chat_id), db, chat_id, start_ts, end_ts, args.format,
+                                          out, args.batch)
+    finally:
+        await chats.close()
+        await db.close()
+    print(f"chat {chat_id}: {rows} row(s) -> {output} in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+    return 0
+
+
+async def check_plans(config, args) -> int:
+    problems = await check_query_plans(args.db or config.db_path, config.tz)
+    for p in problems:
+        print(p)
+    if problems:
+        return 1
+    print("query plans ok")
+    return 0
+
+
+COMMANDS = {
+    "rebuild-leaderboards": rebuild_leaderboards,
+    "check-plans": check_plans,
+    "add-chat": add_chat,
+    "compact": compact,
+    "vacuum": vacuum,
+    "export": export,
+}
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Служебные команды бота")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild-leaderboards", help="пересобрать топы недели/месяца из completions")
+    p = sub.add_parser("check-plans", help="проверить, что запросы не делают полный скан таблиц")
+    p.add_argument("--db", help="база для копии (по умолчанию DB_PATH)")
+    p = sub.add_parser("add-chat", help="добавить/изменить чат, который обслуживает бот")
+    p.add_argument("--chat-id", type=int, required=True)
+    p.add_argument("--topic-id", type=int, required=True, help="тема заданий")
+    p.add_argument("--welcome-topic-id", type=int, help="тема приветствий")
+    p.add_argument("--limit", type=int, help="заданий в неделю (по умолчанию WEEKLY_TASK_LIMIT)")
+    p.add_argument("--tz", help="часовой пояс (по умолчанию TZ)")
+    p.add_argument("--db-path", help="отдельный файл SQLite для данных этого чата")
+    p = sub.add_parser("compact", help="свернуть completions закрытых месяцев в сводки")
+    p.add_argument("--no-archive", action="store_true", help="удалить сырые строки, не копируя в <db>.archive.db")
+    p.add_argument("--batch", type=int, default=5000, help="строк за одну транзакцию")
+    sub.add_parser("vacuum", help="VACUUM и перевод баз на auto_vacuum=INCREMENTAL (бот должен быть остановлен)")
+    p = sub.add_parser("export", help="выгрузить выполнения заданий за период в .csv.gz / .jsonl.gz")
+    p.add_argument("--chat-id", type=int, help="по умолчанию CHAT_ID")
+    p.add_argument("--period", choices=PERIODS, default="month", help="в часовом поясе чата")
+    p.add_argument("--since", help="YYYY-MM-DD, вместо --period")
+    p.add_argument("--until", help="YYYY-MM-DD включительно (по умолчанию сегодня)")
+    p.add_argument("--format", choices=FORMATS, default="csv")
+    p.add_argument("--output", "-o", help="файл (по умолчанию export-<чат>-<период>.<формат>.gz); - — stdout")
+    p.add_argument("--batch", type=int, default=1000, help="строк за одно чтение из базы")
+    args = parser.parse_args()
+
+    config = load_config()
+    return await COMMANDS[args.command](config, args)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,255 @@
+"""
+Метрики горячих путей в текстовом формате Prometheus.
+
+Без внешних зависимостей: счётчики и гистограммы в памяти процесса,
+страница /metrics отдаётся отдельным aiohttp-сервером на METRICS_PORT.
+"""
+import contextvars
+import functools
+import inspect
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import CallbackQuery, Message, TelegramObject
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+# границы корзин гистограмм, сек.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            out.append(f"{self.name}{_labels(self.labelnames, labels)} {value:g}")
+        return out
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [счётчики по корзинам..., сумма, количество]
+        self._values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, *labels):
+        row = self._values.get(labels)
+        if row is None:
+            row = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                row[i] += 1
+                break
+        row[-2] += value
+        row[-1] += 1
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, row in sorted(self._values.items()):
+            cumulative = 0.0
+            for bound, n in zip(self.buckets, row):
+                cumulative += n
+                le = _labels(self.labelnames, labels, f'le="{bound:g}"')
+                out.append(f"{self.name}_bucket{le} {cumulative:g}")
+            le = _labels(self.labelnames, labels, 'le="+Inf"')
+            out.append(f"{self.name}_bucket{le} {row[-1]:g}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {row[-2]:.6f}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, labels)} {row[-1]:g}")
+        return out
+
+
+class Metrics:
+    """Все метрики бота; один экземпляр на процесс, передаётся в workflow_data."""
+
+    def __init__(self):
+        self.updates = Counter(
+            "bot_updates_total", "Updates received, by type and kind", ("type", "kind"))
+        self.update_seconds = Histogram(
+            "bot_update_seconds", "Full update processing time incl. middlewares", ("type", "kind"))
+        self.handler_seconds = Histogram(
+            "bot_handler_seconds", "Handler time by router, handler and kind", ("router", "handler", "kind"))
+        self.handler_errors = Counter(
+            "bot_handler_errors_total", "Exceptions raised by handlers", ("router", "handler"))
+        self.throttled = Counter(
+            "bot_throttled_total", "Button presses dropped by anti-flood: duplicate, user, chat", ("kind", "reason"))
+
+        self.db_calls = Counter(
+            "bot_db_calls_total", "Database method calls", ("method",))
+        self.db_seconds = Histogram(
+            "bot_db_seconds", "Database method latency incl. waiting for the writer", ("method",))
+
+        self.api_calls = Counter(
+            "bot_api_calls_total", "Bot API requests", ("method",))
+        self.api_seconds = Histogram(
+            "bot_api_seconds", "Bot API request latency", ("method",))
+        self.api_errors = Counter(
+            "bot_api_errors_total", "Bot API errors: bad_request, flood_wait, other", ("method", "error"))
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in vars(self).values():
+            if isinstance(metric, (Counter, Histogram)):
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def event_kind(event: TelegramObject) -> str:
+    """Короткая метка события: done/undo/top/me/... для колбэков, link/text для сообщений."""
+    if isinstance(event, CallbackQuery):
+        data = event.data or ""
+        return data.split(":", 1)[0] or "empty"
+    if isinstance(event, Message):
+        if event.text and "t.me/" in event.text:
+            return "link"
+        return "text" if event.text else "other"
+    return type(event).__name__
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware на update: полное время обработки апдейта."""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        update_type = event.event_type
+        kind = event_kind(event.event)
+        self.metrics.updates.inc(update_type, kind)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.metrics.update_seconds.observe(time.perf_counter() - started, update_type, kind)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: время конкретного хендлера с именем роутера."""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        router = data["event_router"].name
+        name = data["handler"].callback.__name__
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.metrics.handler_errors.inc(router, name)
+            raise
+        finally:
+            self.metrics.handler_seconds.observe(time.perf_counter() - started, router, name, event_kind(event))
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: вызовы Bot API, их время и ошибки."""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def __call__(self, make_request, bot: Bot, method):
+        name = method.__api_method__
+        self.metrics.api_calls.inc(name)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            self.metrics.api_errors.inc(name, "flood_wait")
+            raise
+        except TelegramBadRequest:
+            self.metrics.api_errors.inc(name, "bad_request")
+            raise
+        except TelegramAPIError:
+            self.metrics.api_errors.inc(name, "other")
+            raise
+        finally:
+            self.metrics.api_seconds.observe(time.perf_counter() - started, name)
+
+
+_in_db_call = contextvars.ContextVar("_in_db_call", default=False)
+
+
+def wrap_database(db, observe: Callable[[str, float], None]):
+    """
+    Оборачивает публичные корутины экземпляра Database: observe(метод, секунды).
+    Считается только внешний вызов — методы, вызванные из других методов, не двоятся.
+    В время add_completion/remove_completion входит ожидание пачки — так его видит хендлер.
+    """
+    for name, _ in inspect.getmembers(type(db), inspect.iscoroutinefunction):
+        if name.startswith("_") or name in ("init", "close"):
+            continue
+        setattr(db, name, _timed(name, getattr(db, name), observe))
+
+
+def _timed(name: str, method, observe):
+    @functools.wraps(method)
+    async def timed(*args, **kwargs):
+        if _in_db_call.get():
+            return await method(*args, **kwargs)
+        token = _in_db_call.set(True)
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            observe(name, time.perf_counter() - started)
+            _in_db_call.reset(token)
+    return timed
+
+
+def instrument_database(db, metrics: Metrics):
+    def observe(method: str, seconds: float):
+        metrics.db_calls.inc(method)
+        metrics.db_seconds.observe(seconds, method)
+
+    wrap_database(db, observe)
+
+
+async def start_metrics_server(metrics: Metrics, host: str, port: int) -> web.AppRunner:
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info("metrics on http://%s:%s/metrics", host, port)
+    return runner
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from utils import month_range_msk, week_range_msk
+
+log = logging.getLogger(__name__)
+
+RANGES = {
+    "week": week_range_msk,
+    "month": month_range_msk,
+}
+
+# (period, tz) -> последние посчитанные (start, end)
+_bounds: dict[tuple[str, str], tuple[int, int]] = {}
+
+
+def period_bounds(period: str, ts: int, tz: str) -> tuple[int, int]:
+    """
+    Границы недели/месяца, в которые попадает ts. Последний результат на (period, tz)
+    запоминается, так что на горячем пути (клики, топы) ZoneInfo/datetime не строятся,
+    пока ts не вышел за границы текущего периода.
+    """
+    bounds = _bounds.get((period, tz))
+    if bounds is None or not bounds[0] <= ts <= bounds[1]:
+        bounds = _bounds[(period, tz)] = RANGES[period](ts, tz)
+    return bounds
+
+
+class PeriodService:
+    """
+    Текущие неделя и месяц чатов и смена недели.
+    На смене недели задания прошлых недель одним UPDATE получают active = 0,
+    а карточки только что закрытой недели переписываются в фоне с ограничением
+    по скорости. При старте то же самое догоняет всё, что накопилось.
+    """
+
+    def __init__(self, chats, cards, edits_per_minute: int = 20, max_sleep: float = 3600.0):
+        self.chats = chats
+        self.cards = cards
+        self.edits_per_minute = edits_per_minute
+        self.max_sleep = max_sleep
+        self._loop_task: Optional[asyncio.Task] = None
+
+    def week(self, tz: str, now: Optional[int] = None) -> tuple[int, int]:
+        return period_bounds("week", int(time.time()) if now is None else now, tz)
+
+    def month(self, tz: str, now: Optional[int] = None) -> tuple[int, int]:
+        return period_bounds("month", int(time.time()) if now is None else now, tz)
+
+    async def start(self):
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+
+    async def rollover(self, now: int) -> int:
+        """Закрывает задания прошлых недель во всех чатах; возвращает, сколько закрыто."""
+        total = 0
+        for chat in self.chats.all():
+            week_start, _ = self.week(chat.tz, now)
+            db = self.chats.db_for(chat.chat_id)
+            closed = await db.deactivate_tasks_before(chat.chat_id, week_start)
+            if not closed:
+                continue
+            total += len(closed)
+
+            # карточки старше прошлой недели давно никто не видит — их не трогаем
+            prev_week_start, _ = week_range_msk(week_start - 1, chat.tz)
+            recent = [t for t in closed if t.created_at >= prev_week_start and t.card_message_id]
+            self.cards.close_cards(chat.chat_id, recent, self.edits_per_minute)
+            log.info("chat %s: closed %d task(s) of past weeks, %d card(s) to update",
+                     chat.chat_id, len(closed), len(recent))
+        return total
+
+    async def _run(self):
+        while True:
+            now = int(time.time())
+            try:
+                await self.rollover(now)
+            except Exception:
+                log.exception("week rollover failed")
+
+            # проснуться сразу после ближайшего конца недели среди чатов
+            ends = [self.week(chat.tz, now)[1] for chat in self.chats.all()]
+            delay = (min(ends) + 1 - time.time()) if ends else self.max_sleep
+            await asyncio.sleep(min(max(delay, 1.0), self.max_sleep))
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.types import TelegramObject, User
+
+from utils import display_name
+
+log = logging.getLogger(__name__)
+
+
+class ProfileCache:
+    """
+    Отображаемые имена пользователей: LRU в памяти с TTL поверх таблицы users.
+    Заполняется из пользователей, которых бот и так видит в апдейтах;
+    get_chat_member вызывается только для промахов, параллельно и с ограничением.
+    """
+
+    def __init__(
+        self,
+        db,
+        ttl: int = 86400,
+        max_size: int = 5000,
+        fetch_concurrency: int = 5,
+        flush_delay: float = 5.0,
+    ):
+        self.db = db
+        self.ttl = ttl
+        self.max_size = max_size
+        self.flush_delay = flush_delay
+        self._fetch_sem = asyncio.Semaphore(fetch_concurrency)
+
+        # user_id -> (имя, когда получено)
+        self._names: "OrderedDict[int, tuple[str, int]]" = OrderedDict()
+        self._dirty: dict[int, tuple[str, int]] = {}
+        self._flusher: Optional[asyncio.Task] = None
+
+    def remember(self, user: Optional[User]):
+        if user is None or user.is_bot:
+            return
+        now = int(time.time())
+        name = display_name(user)
+
+        cached = self._names.get(user.id)
+        if cached and cached[0] == name and now - cached[1] < self.ttl // 2:
+            return
+
+        self._put(user.id, name, now)
+        self._dirty[user.id] = (name, now)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def names(self, bot: Bot, chat_id: int, user_ids: list[int]) -> dict[int, str]:
+        now = int(time.time())
+        result: dict[int, str] = {}
+        stale: dict[int, str] = {}
+
+        for user_id in user_ids:
+            cached = self._names.get(user_id)
+            if cached:
+                self._names.move_to_end(user_id)
+                if now - cached[1] < self.ttl:
+                    result[user_id] = cached[0]
+                else:
+                    stale[user_id] = cached[0]
+
+        missing = [u for u in user_ids if u not in result and u not in stale]
+        for user_id, (name, updated_at) in (await self.db.get_user_names(missing)).items():
+            self._put(user_id, name, updated_at)
+            if now - updated_at < self.ttl:
+                result[user_id] = name
+            else:
+                stale[user_id] = name
+
+        to_fetch = [u for u in user_ids if u not in result]
+        if to_fetch:
+            fetched = await asyncio.gather(*(self._fetch(bot, chat_id, u) for u in to_fetch))
+            for user_id, user in zip(to_fetch, fetched):
+                if user is not None:
+                    self.remember(user)
+                    result[user_id] = display_name(user)
+                else:
+                    result[user_id] = stale.get(user_id, str(user_id))
+
+        return result
+
+    async def _fetch(self, bot: Bot, chat_id: int, user_id: int) -> Optional[User]:
+        async with self._fetch_sem:
+            try:
+                chat_member = await bot.get_chat_member(chat_id, user_id)
+                return chat_member.user
+            except Exception:
+                return None
+
+    def _put(self, user_id: int, name: str, updated_at: int):
+        self._names[user_id] = (name, updated_at)
+        self._names.move_to_end(user_id)
+        while len(self._names) > self.max_size:
+            self._names.popitem(last=False)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        await self.flush()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        try:
+            await self.db.save_user_names([(u, name, ts) for u, (name, ts) in dirty.items()])
+        except Exception:
+            log.exception("failed to save %d user names", len(dirty))
+
+    async def close(self):
+        if self._flusher is not None and not self._flusher.done():
+            self._flusher.cancel()
+        await self.flush()
+
+
+class ProfileMiddleware(BaseMiddleware):
+    """Запоминает автора каждого апдейта (сообщения, колбэки и т.д.)."""
+
+    def __init__(self, profiles: ProfileCache):
+        self.profiles = profiles
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        self.profiles.remember(data.get("event_from_user"))
+        return await handler(event, data)
@@ -0,0 +1,148 @@
+"""
+Проверка планов запросов Database: ни один запрос горячего пути
+не должен читать таблицу целиком (SCAN без индекса).
+
+Все публичные методы Database прогоняются на копии базы с трассировкой SQL,
+для каждого выполненного запроса берётся EXPLAIN QUERY PLAN.
+Запуск: python manage.py check-plans
+"""
+import inspect
+import os
+import sqlite3
+import tempfile
+import time
+
+from db import Database, PERIODS
+
+# Методы, которым по смыслу положено читать всю таблицу (прогрев, пересборка).
+FULL_SCAN_OK = {
+    "init",
+    "close",
+    "set_trace_callback",
+    "reload_bans_if_changed",
+    "rebuild_leaderboards",
+    "get_scheduled_deletions",
+    "get_chats",
+    "compact_completions",
+    "vacuum",
+    # ANALYZE по маленькой проверочной базе к тому же испортил бы планы остальных запросов
+    "analyze",
+}
+
+SKIP_PREFIXES = ("PRAGMA", "BEGIN", "COMMIT", "ROLLBACK", "CREATE")
+
+
+async def exercise(db: Database) -> set[str]:
+    """Вызывает каждый метод горячего пути хотя бы раз. Возвращает имена вызванных."""
+    now = int(time.time())
+    called = set()
+
+    async def call(name: str, *args, **kwargs):
+        called.add(name)
+        return await getattr(db, name)(*args, **kwargs)
+
+    created, _ = await call("create_tasks", 1, 1, 100, [("https://t.me/plan_check/1", "u:plan_check:1")],
+                            now, now - 3600, now + 3600, 10)
+    task_id = created[0]["task_id"]
+    # вторая ссылка — дубль первой: проверяем и поиск существующего задания
+    links = [("https://t.me/plan_check/2", "u:plan_check:2"), ("https://t.me/plan_check/1", "u:plan_check:1")]
+    created, _ = await call("create_tasks", 1, 1, 100, links, now, now - 3600, now + 3600, 10)
+    await call("set_task_card_message_ids", [(task_id, 10), (created[0]["task_id"], 13)])
+    await call("get_task", task_id)
+    await call("active_task", task_id)
+    await call("get_tasks", [task_id, created[0]["task_id"]])
+    await call("get_tasks_by_post_keys", 1, ["u:plan_check:1", "u:plan_check:2"])
+    await call("count_user_tasks_in_range", 1, 100, now - 3600, now + 3600)
+    await call("deactivate_tasks_before", 1, now - 7 * 86400)
+
+    await call("add_completion", 1, task_id, 200, now)
+    await call("count_completions", task_id)
+    await call("check_completion_counts", [task_id])
+    await call("user_stats", 1, 200, now)
+    week_start, _ = PERIODS["week"](now, db.tz)
+    await call("top_in_period", 1, "week", week_start)
+    await call("leaderboard_version", 1, "week", week_start)
+    called.add("iter_completions")
+    async for _ in db.iter_completions(1, now - 3600, now + 3600):
+        pass
+    await call("remove_completion", 1, task_id, 200)
+
+    await call("ban_user", 300, now + 60)
+    await call("is_banned", 300, now)
+    await call("unban_user", 300)
+
+    await call("set_last_bot_message_id", 1, 1, "top", 11, now)
+    await call("get_last_bot_message_id", 1, 1, "top")
+
+    await call("upsert_chat", 1, 1, None, 10, db.tz)
+    called.update({"tz_for", "table_version", "compaction_cutoff"})
+    db.tz_for(1)
+    db.compaction_cutoff(1, now)
+    await db.table_version("chats")
+
+    await call("save_user_names", [(200, "@plan_check", now)])
+    await call("get_user_names", [200, 201])
+
+    await call("add_scheduled_deletion", 1, 12, now)
+    await call("remove_scheduled_deletions", [(1, 12)])
+
+    await call("checkpoint", "PASSIVE")
+    await call("incremental_vacuum", 10)
+    called.add("wal_size")
+    db.wal_size()
+    return called
+
+
+def full_scans(conn: sqlite3.Connection, sql: str) -> list[str]:
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    rows = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+    # "SCAN me" по CTE или "SCAN CONSTANT ROW" — не чтение таблицы
+    return [
+        detail for *_, detail in rows
+        if detail.startswith("SCAN ") and "INDEX" not in detail
+        and detail.split()[1] in tables
+    ]
+
+
+async def check_query_plans(source_path: str, tz: str) -> list[str]:
+    """Возвращает список проблем; пустой список — всё в порядке."""
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "plans.db")
+        if os.path.exists(source_path):
+            src = sqlite3.connect(source_path)
+            dst = sqlite3.connect(path)
+            src.backup(dst)
+            src.close()
+            dst.close()
+
+        db = Database(path, tz=tz, pool_size=1)
+        await db.init()
+        statements: list[str] = []
+        await db.set_trace_callback(statements.append)
+        try:
+            called = await exercise(db)
+            await db.set_trace_callback(None)
+            # планы смотрим до db.close(): PRAGMA optimize при закрытии соберёт
+            # статистику по крошечной проверочной базе, и планировщику станет выгоден SCAN
+            conn = sqlite3.connect(path)
+            try:
+                for sql in dict.fromkeys(statements):
+                    if sql.lstrip().upper().startswith(SKIP_PREFIXES):
+                        continue
+                    for detail in full_scans(conn, sql):
+                        problems.append(f"{detail}: {' '.join(sql.split())}")
+            finally:
+                conn.close()
+        finally:
+            await db.set_trace_callback(None)
+            await db.close()
+
+        public = {
+            name for name, fn in inspect.getmembers(Database, inspect.isfunction)
+            if not name.startswith("_")
+        }
+        for name in sorted(public - called - FULL_SCAN_OK):
+            problems.append(f"{name}: метод не проверяется (добавь его в query_plans.exercise)")
+
+    return problems
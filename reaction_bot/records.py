@@ -0,0 +1,80 @@
+"""
+Строки таблиц в виде компактных объектов со __slots__.
+
+Создаются прямо в sqlite3 через row_factory курсора (Task.from_row и т.п.),
+без промежуточного dict на каждую строку. Порядок полей = порядок колонок
+в *_COLUMNS, их и надо подставлять в SELECT.
+"""
+from typing import Optional
+
+
+class Task:
+    __slots__ = (
+        "id", "chat_id", "topic_id", "created_by", "post_url", "post_key",
+        "created_at", "active", "card_message_id",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        chat_id: int,
+        topic_id: int,
+        created_by: int,
+        post_url: str,
+        post_key: str,
+        created_at: int,
+        active: bool,
+        card_message_id: Optional[int],
+    ):
+        self.id = id
+        self.chat_id = chat_id
+        self.topic_id = topic_id
+        self.created_by = created_by
+        self.post_url = post_url
+        self.post_key = post_key
+        self.created_at = created_at
+        self.active = bool(active)
+        self.card_message_id = card_message_id
+
+    @classmethod
+    def from_row(cls, cursor, row: tuple) -> "Task":
+        return cls(*row)
+
+    def __repr__(self) -> str:
+        return f"Task(id={self.id}, chat_id={self.chat_id}, post_key={self.post_key!r}, active={self.active})"
+
+
+class Completion:
+    __slots__ = ("task_id", "user_id", "completed_at")
+
+    def __init__(self, task_id: int, user_id: int, completed_at: int):
+        self.task_id = task_id
+        self.user_id = user_id
+        self.completed_at = completed_at
+
+    @classmethod
+    def from_row(cls, cursor, row: tuple) -> "Completion":
+        return cls(*row)
+
+    def __repr__(self) -> str:
+        return f"Completion(task_id={self.task_id}, user_id={self.user_id}, completed_at={self.completed_at})"
+
+
+class Ban:
+    __slots__ = ("user_id", "banned_until")
+
+    def __init__(self, user_id: int, banned_until: Optional[int]):
+        self.user_id = user_id
+        self.banned_until = banned_until
+
+    @classmethod
+    def from_row(cls, cursor, row: tuple) -> "Ban":
+        return cls(*row)
+
+    def __repr__(self) -> str:
+        return f"Ban(user_id={self.user_id}, banned_until={self.banned_until})"
+
+
+TASK_COLUMNS = "id, chat_id, topic_id, created_by, post_url, post_key, created_at, active, card_message_id"
+COMPLETION_COLUMNS = "task_id, user_id, completed_at"
+BAN_COLUMNS = "user_id, banned_until"
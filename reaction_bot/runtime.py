@@ -0,0 +1,75 @@
+"""
+Профиль рантайма: RUNTIME_PROFILE=default | fast.
+
+fast — uvloop вместо стандартного цикла asyncio, orjson для разбора апдейтов
+и запросов к Bot API, сессия aiohttp с явным пулом keep-alive соединений
+и таймаутами. uvloop и orjson необязательны: если пакета нет, профиль
+молча берёт стандартную замену и пишет об этом в лог.
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Callable, Coroutine, TypeVar
+
+from aiogram.client.session.aiohttp import AiohttpSession
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def run(coro: Coroutine[Any, Any, T], profile: str) -> T:
+    """asyncio.run, но в профиле fast — на uvloop, если он установлен."""
+    loop_factory = None
+    if profile == "fast":
+        try:
+            import uvloop
+        except ImportError:
+            log.info("uvloop is not installed, using the default asyncio loop")
+        else:
+            loop_factory = uvloop.new_event_loop
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        return runner.run(coro)
+
+
+def json_codec(profile: str) -> tuple[Callable[..., Any], Callable[..., str]]:
+    """(loads, dumps) для сессии бота: orjson в профиле fast, иначе стандартный json."""
+    if profile == "fast":
+        try:
+            import orjson
+        except ImportError:
+            log.info("orjson is not installed, using the standard json module")
+        else:
+            def dumps(obj: Any) -> str:
+                try:
+                    return orjson.dumps(obj).decode()
+                except TypeError:
+                    # то, что orjson не умеет (int больше 64 бит и т.п.)
+                    return json.dumps(obj, ensure_ascii=False)
+
+            return orjson.loads, dumps
+    return json.loads, json.dumps
+
+
+class PooledSession(AiohttpSession):
+    """AiohttpSession с настраиваемым keep-alive: все запросы идут на один хост Bot API."""
+
+    def __init__(self, limit: int = 100, keepalive_timeout: float = 30.0, **kwargs: Any):
+        super().__init__(limit=limit, **kwargs)
+        self._connector_init["limit_per_host"] = limit
+        self._connector_init["keepalive_timeout"] = keepalive_timeout
+
+
+def make_session(config, **kwargs: Any) -> AiohttpSession:
+    """Сессия Bot API под профиль из config; kwargs уходят в конструктор (api=... и т.п.)."""
+    if config.runtime_profile != "fast":
+        return AiohttpSession(**kwargs)
+    loads, dumps = json_codec(config.runtime_profile)
+    return PooledSession(
+        limit=config.api_pool_size,
+        keepalive_timeout=config.api_keepalive,
+        timeout=config.api_timeout,
+        json_loads=loads,
+        json_dumps=dumps,
+        **kwargs,
+    )
@@ -0,0 +1,98 @@
+import asyncio
+import heapq
+import logging
+import time
+from collections import defaultdict
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+log = logging.getLogger(__name__)
+
+# deleteMessages принимает не больше 100 id за вызов
+DELETE_BATCH = 100
+
+
+class DeletionScheduler:
+    """
+    Отложенное удаление сообщений бота.
+    Задания хранятся в таблице scheduled_deletions и в куче по времени удаления;
+    один цикл ждёт ближайшего срока и удаляет всё созревшее пачками по чатам.
+    После перезапуска просроченные удаления выполняются сразу.
+    """
+
+    def __init__(self, bot: Bot, db):
+        self.bot = bot
+        self.db = db
+        self._heap: list[tuple[int, int, int]] = []   # (delete_at, chat_id, message_id)
+        self._wakeup = asyncio.Event()
+        self._loop_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    async def start(self):
+        for chat_id, message_id, delete_at in await self.db.get_scheduled_deletions():
+            self._heap.append((delete_at, chat_id, message_id))
+        heapq.heapify(self._heap)
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._loop_task is not None:
+            # wait_for в 3.11 может проглотить отмену, если _wakeup сработал в тот же момент
+            self._closing = True
+            self._wakeup.set()
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+
+    async def schedule(self, chat_id: int, message_id: int, delay: int):
+        delete_at = int(time.time()) + delay
+        await self.db.add_scheduled_deletion(chat_id, message_id, delete_at)
+        heapq.heappush(self._heap, (delete_at, chat_id, message_id))
+        self._wakeup.set()
+
+    async def _run(self):
+        while not self._closing:
+            self._wakeup.clear()
+            timeout = None
+            if self._heap:
+                timeout = max(0, self._heap[0][0] - time.time())
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = int(time.time())
+            due: dict[int, list[int]] = defaultdict(list)
+            while self._heap and self._heap[0][0] <= now:
+                _, chat_id, message_id = heapq.heappop(self._heap)
+                due[chat_id].append(message_id)
+
+            try:
+                await self._delete(due)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("scheduled deletion failed")
+
+    async def _delete(self, due: dict[int, list[int]]):
+        for chat_id, message_ids in due.items():
+            for i in range(0, len(message_ids), DELETE_BATCH):
+                chunk = message_ids[i:i + DELETE_BATCH]
+                try:
+                    await self.bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+                except TelegramRetryAfter as e:
+                    # вернём в очередь и попробуем позже
+                    retry_at = int(time.time()) + e.retry_after
+                    for message_id in chunk:
+                        heapq.heappush(self._heap, (retry_at, chat_id, message_id))
+                    continue
+                except TelegramBadRequest:
+                    # уже удалены / слишком старые — считаем выполненным
+                    pass
+                await self.db.remove_scheduled_deletions([(chat_id, m) for m in chunk])
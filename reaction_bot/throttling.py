@@ -0,0 +1,117 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+
+# кнопки, на которые бот отвечает сообщением в чат: их дополнительно ограничиваем на весь чат
+POSTING_KINDS = frozenset({"me", "top", "month_top", "rules"})
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated_at")
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated_at = now
+
+    def take(self, rate: float, capacity: float, now: float) -> float:
+        """Забирает токен; 0 — можно, иначе сколько секунд ждать следующего."""
+        self.tokens = min(capacity, self.tokens + (now - self.updated_at) * rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+
+class Buckets:
+    """Корзины по ключу с вытеснением давно не тронутых (выброшенная корзина = полная)."""
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = 50000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Any, TokenBucket]" = OrderedDict()
+
+    def take(self, key, now: float) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.capacity, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.take(self.rate, self.capacity, now)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Антифлуд для кнопок. Стоит outer-middleware на callback_query, то есть до фильтров
+    и хендлеров: отсечённое нажатие получает только call.answer, без БД и прочего API.
+
+    - повтор того же колбэка, пока первый ещё обрабатывается, просто подтверждается;
+    - на пользователя и вид кнопки (done/undo/top/...) — token bucket rate/burst;
+    - кнопки, которые постят сообщение в чат, дополнительно ограничены на весь чат
+      (Telegram сам не даёт группе больше ~20 сообщений в минуту).
+    """
+
+    def __init__(
+        self,
+        rate: float = 0.5,
+        burst: int = 3,
+        chat_per_minute: int = 20,
+        metrics=None,
+    ):
+        self.users = Buckets(rate, burst)
+        self.chats = Buckets(chat_per_minute / 60, chat_per_minute)
+        self.metrics = metrics
+        self._inflight: set[tuple] = set()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, CallbackQuery):
+            return await handler(event, data)
+
+        chat_id = event.message.chat.id if event.message else None
+        message_id = event.message.message_id if event.message else None
+        kind = (event.data or "").split(":", 1)[0]
+
+        key = (event.from_user.id, chat_id, message_id, event.data)
+        if key in self._inflight:
+            self._count(kind, "duplicate")
+            await event.answer()
+            return None
+
+        now = time.monotonic()
+        wait = self.users.take((event.from_user.id, kind), now)
+        if wait:
+            self._count(kind, "user")
+            await event.answer(f"Слишком часто. Подожди {_seconds(wait)} с.")
+            return None
+
+        if kind in POSTING_KINDS and chat_id is not None:
+            wait = self.chats.take(chat_id, now)
+            if wait:
+                self._count(kind, "chat")
+                await event.answer(f"Бот сейчас отвечает слишком часто, попробуй через {_seconds(wait)} с.")
+                return None
+
+        self._inflight.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._inflight.discard(key)
+
+    def _count(self, kind: str, reason: str):
+        if self.metrics is not None:
+            self.metrics.throttled.inc(kind, reason)
+
+
+def _seconds(wait: float) -> int:
+    return max(1, round(wait))
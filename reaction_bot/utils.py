@@ -11,16 +11,17 @@ CHAN_RE = re.compile(r"t\.me/(?P<uname>[A-Za-z0-9_]{5,})/(?P<msgid>\d+)")
 PRIV_RE = re.compile(r"t\.me/c/(?P<cid>\d+)/(?P<msgid>\d+)")
 
 
-def extract_first_tme_url(text: str) -> Optional[str]:
+def extract_tme_urls(text: str) -> list[str]:
+    """Все t.me-ссылки из текста по порядку, без повторов."""
     if not text:
-        return None
-    m = TME_RE.search(text)
-    if not m:
-        return None
-    url = m.group(1)
-    if url.startswith("t.me/"):
-        url = "https://" + url
-    return url
+        return []
+    urls = []
+    for url in TME_RE.findall(text):
+        if url.startswith("t.me/"):
+            url = "https://" + url
+        if url not in urls:
+            urls.append(url)
+    return urls
 
 
 def parse_post_key(url: str) -> Optional[str]:
@@ -56,9 +57,12 @@ def month_range_msk(now_ts: int, tz_name: str = "Europe/Moscow") -> Tuple[int, i
     return int(start.timestamp()), int(end.timestamp())
 
 
-def is_same_week_msk(task_created_ts: int, now_ts: int, tz_name: str = "Europe/Moscow") -> bool:
-    week_start, week_end = week_range_msk(now_ts, tz_name)
-    return week_start <= task_created_ts <= week_end
+# подпись часового пояса в текстах бота; для остальных поясов — имя из базы tz
+TZ_LABELS = {"Europe/Moscow": "МСК"}
+
+
+def tz_label(tz_name: str) -> str:
+    return TZ_LABELS.get(tz_name, tz_name)
 
 
 def display_name(user) -> str:
@@ -0,0 +1,127 @@
+"""
+Приём апдейтов через webhook вместо long polling.
+
+Telegram получает 200 сразу, а сам апдейт уходит в ограниченную очередь,
+которую разбирают несколько воркеров. Если очередь забита дольше
+enqueue_timeout секунд, отвечаем 503 — Telegram повторит доставку позже.
+
+Локальная проверка (без WEBHOOK_URL бот не трогает setWebhook):
+    curl -X POST localhost:8080/webhook \\
+        -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \\
+        -H "Content-Type: application/json" -d @update.json
+"""
+import asyncio
+import hmac
+import json
+import logging
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class UpdateQueue:
+    def __init__(self, dp: Dispatcher, bot: Bot, size: int, workers: int, data: dict[str, Any]):
+        self.dp = dp
+        self.bot = bot
+        self.data = data
+        self.queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize=size)
+        self._workers = [asyncio.create_task(self._work()) for _ in range(max(1, workers))]
+
+    async def put(self, update: dict, timeout: float) -> bool:
+        try:
+            self.queue.put_nowait(update)
+            return True
+        except asyncio.QueueFull:
+            pass
+        try:
+            await asyncio.wait_for(self.queue.put(update), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _work(self):
+        while True:
+            update = await self.queue.get()
+            update_id = update.get("update_id")
+            try:
+                await self.dp.feed_raw_update(self.bot, update, **self.data)
+            except Exception:
+                log.exception("update %s failed", update_id)
+            finally:
+                self.queue.task_done()
+
+    async def close(self, drain_timeout: float = 10.0):
+        # уже подтверждённые Telegram апдейты стараемся доделать
+        try:
+            await asyncio.wait_for(self.queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            log.warning("dropping %d queued updates on shutdown", self.queue.qsize())
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+
+def check_config(config):
+    # сервер по умолчанию слушает 0.0.0.0: без секрета апдейт мог бы прислать кто угодно
+    if not config.webhook_secret:
+        raise RuntimeError("BOT_MODE=webhook requires WEBHOOK_SECRET")
+
+
+def make_app(queue: UpdateQueue, path: str, secret: str, enqueue_timeout: float, loads=json.loads) -> web.Application:
+    async def handle(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=401)
+        try:
+            update = loads(await request.read())
+        except ValueError:
+            return web.Response(status=400)
+        # апдейт — всегда объект; [1] или null воркер разобрать не сможет
+        if not isinstance(update, dict):
+            return web.Response(status=400)
+
+        if not await queue.put(update, enqueue_timeout):
+            return web.Response(status=503)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, queue=None, **data):
+    # config — из workflow_data: он нужен и хендлерам, поэтому остаётся в data
+    config = data["config"]
+    check_config(config)
+    # queue — куда складывать апдейты; по умолчанию своя UpdateQueue (в режиме WORKERS — пул воркеров)
+    if queue is None:
+        queue = UpdateQueue(dp, bot, config.webhook_queue_size, config.webhook_workers, data)
+    # тот же разбор JSON, что у сессии бота (orjson в профиле fast)
+    app = make_app(queue, config.webhook_path, config.webhook_secret, config.webhook_enqueue_timeout,
+                   loads=bot.session.json_loads)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.webhook_host, config.webhook_port)
+    await site.start()
+    log.info("webhook server on %s:%s%s", config.webhook_host, config.webhook_port, config.webhook_path)
+
+    if config.webhook_url:
+        await bot.set_webhook(
+            url=config.webhook_url.rstrip("/") + config.webhook_path,
+            secret_token=config.webhook_secret,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=config.drop_pending_updates,
+        )
+
+    await dp.emit_startup(bot=bot, **data)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await queue.close()
+        await dp.emit_shutdown(bot=bot, **data)
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import User
+
+from throttling import Buckets
+
+log = logging.getLogger(__name__)
+
+
+def welcome_text(users: list[User], max_names: int) -> str:
+    names = ", ".join(u.mention_html() for u in users[:max_names])
+    if len(users) > max_names:
+        names += f" и ещё {len(users) - max_names}"
+    you, look = ("тебя", "загляни") if len(users) == 1 else ("вас", "загляните")
+    return (
+        f"👋 Добро пожаловать, {names}!\n\n"
+        f"Рады видеть {you} на нашем чудесном корабле.\n"
+        f"Обязательно {look} в тему Правила и Знакомства ☺"
+    )
+
+
+class WelcomeAggregator:
+    """
+    Приветствия новичков пачками.
+    Входы в чат копятся window секунд и приветствуются одним сообщением;
+    новое приветствие заменяет предыдущее (старое сразу уходит в удаление).
+    Сообщений-приветствий в чат — не больше per_minute в минуту: пока лимит
+    исчерпан, входы продолжают копиться в ту же пачку.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        deletions,
+        window: float = 3.0,
+        per_minute: int = 4,
+        delete_after: int = 60,
+        max_names: int = 10,
+    ):
+        self.bot = bot
+        self.deletions = deletions
+        self.window = window
+        self.delete_after = delete_after
+        self.max_names = max_names
+        self._rate = Buckets(per_minute / 60, per_minute)
+
+        # chat_id -> (тема приветствий, {user_id: User}) — ещё не поприветствованные
+        self._pending: dict[int, tuple[int, dict[int, User]]] = {}
+        self._flushers: dict[int, asyncio.Task] = {}
+        # chat_id -> (message_id, когда отправлено) последнего приветствия
+        self._last: dict[int, tuple[int, float]] = {}
+
+    def add(self, chat_id: int, topic_id: int, user: User):
+        _, users = self._pending.setdefault(chat_id, (topic_id, {}))
+        users[user.id] = user
+        if chat_id not in self._flushers:
+            self._flushers[chat_id] = asyncio.create_task(self._flush_later(chat_id))
+
+    async def _flush_later(self, chat_id: int):
+        try:
+            await asyncio.sleep(self.window)
+            while wait := self._rate.take(chat_id, time.monotonic()):
+                await asyncio.sleep(wait)
+
+            # с этого момента новые входы начинают следующую пачку
+            self._flushers.pop(chat_id, None)
+            topic_id, users = self._pending.pop(chat_id)
+            await self._send(chat_id, topic_id, list(users.values()))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("welcome failed: chat %s", chat_id)
+        finally:
+            if self._flushers.get(chat_id) is asyncio.current_task():
+                self._flushers.pop(chat_id, None)
+
+    async def _send(self, chat_id: int, topic_id: int, users: list[User]):
+        text = welcome_text(users, self.max_names)
+        for _ in range(2):
+            try:
+                msg = await self.bot.send_message(chat_id=chat_id, message_thread_id=topic_id, text=text)
+                break
+            except TelegramRetryAfter as e:
+                log.warning("welcome in %s: flood control, retry after %s s", chat_id, e.retry_after)
+                await asyncio.sleep(e.retry_after)
+        else:
+            return
+
+        previous = self._last.get(chat_id)
+        self._last[chat_id] = (msg.message_id, time.monotonic())
+        await self.deletions.schedule(chat_id, msg.message_id, self.delete_after)
+        # предыдущее, если ещё не удалено по сроку, убираем сразу
+        if previous is not None and time.monotonic() - previous[1] < self.delete_after:
+            await self.deletions.schedule(chat_id, previous[0], 0)
+
+    async def close(self):
+        tasks = list(self._flushers.values())
+        self._flushers.clear()
+        self._pending.clear()
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,480 @@
+"""
+Режим нескольких процессов: WORKERS=N.
+
+Главный процесс принимает апдейты (long polling или webhook), не разбирая их
+aiogram'ом, и раздаёт сырой JSON N процессам-воркерам по стабильному хэшу
+chat_id (если чата нет — user_id). Все апдейты чата попадают в один воркер,
+поэтому его кэши (карточки, топы, антифлуд, приветствия) видят чат целиком,
+а апдейты одного пользователя в чате воркер выполняет строго по очереди.
+
+Каждый воркер — свой Dispatcher со всеми роутерами и свой Bot. Базы открыты
+только в главном процессе: воркеры вызывают методы Database, DeletionScheduler
+и ExportService через RemoteService, так что писатель SQLite, пачки зачётов
+и кэши счётчиков одни на все процессы. Там же работают смена недели, удаления и обслуживание баз.
+
+Процессы общаются по TCP на 127.0.0.1: кадр = 4 байта длины + pickle. Первый
+кадр соединения — случайный токен из аргументов воркера; до его проверки
+ничего не распаковывается.
+"""
+import asyncio
+import hmac
+import itertools
+import json
+import logging
+import multiprocessing
+import pickle
+import secrets
+import signal
+import zlib
+from typing import Any, Optional
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+
+log = logging.getLogger(__name__)
+
+ROLE_UPDATES = b"U"
+ROLE_RPC = b"R"
+TOKEN_BYTES = 16
+
+# сервисы главного процесса, доступные воркерам по имени (кроме баз "db:<путь>")
+SERVICES = ("deletions", "exports")
+# методы, которые воркер не может вызвать у сервисов главного процесса
+FORBIDDEN_METHODS = frozenset({"init", "close", "start", "vacuum", "set_trace_callback"})
+
+
+def route_ids(update: dict) -> tuple[Optional[int], Optional[int]]:
+    """(chat_id, user_id) сырого апдейта; None — если в апдейте такого нет."""
+    if not isinstance(update, dict):
+        return None, None
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat") or {}
+        user = event.get("from") or event.get("user") or {}
+        return chat.get("id"), user.get("id")
+    return None, None
+
+
+def shard_of(update: dict, workers: int) -> int:
+    """Номер воркера: один и тот же для чата во всех запусках (hash() для этого не годится)."""
+    chat_id, user_id = route_ids(update)
+    key = chat_id if chat_id is not None else user_id or 0
+    return zlib.crc32(str(key).encode()) % workers
+
+
+def _frame(obj: Any) -> bytes:
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    return len(data).to_bytes(4, "big") + data
+
+
+async def _read_raw(reader: asyncio.StreamReader, max_size: Optional[int] = None) -> bytes:
+    size = int.from_bytes(await reader.readexactly(4), "big")
+    if max_size is not None and size > max_size:
+        raise ConnectionError(f"frame of {size} bytes, expected at most {max_size}")
+    return await reader.readexactly(size)
+
+
+async def _read(reader: asyncio.StreamReader) -> Any:
+    return pickle.loads(await _read_raw(reader))
+
+
+# ====== главный процесс ======
+
+class _UpdateChannel:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.lock = asyncio.Lock()
+
+    async def send(self, data: bytes):
+        # до записи — только ожидания; отменённый put ничего не отправит наполовину
+        async with self.lock:
+            await self.writer.drain()
+            self.writer.write(data)
+
+
+class WorkerPool:
+    """
+    Процессы-воркеры и сервер, через который они получают апдейты и ходят в базы.
+    put(update, timeout) совместим с webhook.UpdateQueue.
+    """
+
+    def __init__(self, data: dict, count: int, start_timeout: float = 30.0, stop_timeout: float = 15.0):
+        self.data = data
+        self.count = count
+        self.start_timeout = start_timeout
+        self.stop_timeout = stop_timeout
+
+        self._token = secrets.token_bytes(TOKEN_BYTES)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._processes: list[multiprocessing.Process] = []
+        self._channels: dict[int, _UpdateChannel] = {}
+        self._connected = asyncio.Event()
+        self._failed = asyncio.Event()
+        self._rpc_tasks: set[asyncio.Task] = set()
+        self._watchers: set[asyncio.Task] = set()
+        self._closing = False
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._accept, "127.0.0.1", 0)
+        port = self._server.sockets[0].getsockname()[1]
+
+        ctx = multiprocessing.get_context("spawn")
+        for index in range(self.count):
+            p = ctx.Process(target=worker_main, args=(index, port, self._token), name=f"worker-{index}")
+            p.start()
+            self._processes.append(p)
+            self._watchers.add(asyncio.create_task(self._watch(p)))
+
+        connected = asyncio.create_task(self._connected.wait())
+        failed = asyncio.create_task(self._failed.wait())
+        done, _ = await asyncio.wait({connected, failed}, timeout=self.start_timeout, return_when=asyncio.FIRST_COMPLETED)
+        connected.cancel()
+        failed.cancel()
+        if connected not in done:
+            raise RuntimeError("worker processes did not start")
+        log.info("%d worker process(es) connected", self.count)
+
+    async def put(self, update: dict, timeout: Optional[float] = None) -> bool:
+        if not isinstance(update, dict):
+            raise ValueError(f"update must be a JSON object, got {type(update).__name__}")
+        channel = self._channels[shard_of(update, self.count)]
+        try:
+            await asyncio.wait_for(channel.send(_frame(update)), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def wait_failed(self):
+        await self._failed.wait()
+
+    async def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        # конец потока апдейтов — воркер доделывает начатое, закрывается и выходит
+        for channel in self._channels.values():
+            channel.writer.close()
+
+        loop = asyncio.get_running_loop()
+        for p in self._processes:
+            await loop.run_in_executor(None, p.join, self.stop_timeout)
+            if p.is_alive():
+                log.warning("%s did not stop in %s s, terminating", p.name, self.stop_timeout)
+                p.terminate()
+                await loop.run_in_executor(None, p.join)
+
+        if self._server is not None:
+            self._server.close()
+        for t in list(self._rpc_tasks):
+            t.cancel()
+        await asyncio.gather(*self._rpc_tasks, return_exceptions=True)
+
+    async def _watch(self, p: multiprocessing.Process):
+        await asyncio.get_running_loop().run_in_executor(None, p.join)
+        if not self._closing:
+            log.error("%s exited with code %s", p.name, p.exitcode)
+            self._failed.set()
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            hello = await asyncio.wait_for(_read_raw(reader, max_size=64), self.start_timeout)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        token, role, index = hello[:TOKEN_BYTES], hello[TOKEN_BYTES:TOKEN_BYTES + 1], hello[TOKEN_BYTES + 1:]
+        if not hmac.compare_digest(token, self._token):
+            log.warning("rejected worker connection with a wrong token")
+            writer.close()
+            return
+
+        if role == ROLE_UPDATES:
+            self._channels[int(index)] = _UpdateChannel(writer)
+            if len(self._channels) == self.count:
+                self._connected.set()
+        elif role == ROLE_RPC:
+            await self._serve_rpc(reader, writer)
+
+    async def _serve_rpc(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        lock = asyncio.Lock()
+        try:
+            while True:
+                call = await _read(reader)
+                t = asyncio.create_task(self._answer(call, writer, lock))
+                self._rpc_tasks.add(t)
+                t.add_done_callback(self._rpc_tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _answer(self, call: tuple, writer: asyncio.StreamWriter, lock: asyncio.Lock):
+        call_id, target, method, args, kwargs = call
+        try:
+            if method.startswith("_") or method in FORBIDDEN_METHODS:
+                raise AttributeError(f"{method} is not available to workers")
+            service = await self._resolve(target)
+            reply = (call_id, True, await getattr(service, method)(*args, **kwargs))
+        except Exception as e:
+            reply = (call_id, False, e)
+        try:
+            data = _frame(reply)
+        except Exception as e:
+            data = _frame((call_id, False, RuntimeError(f"{target}.{method}: unpicklable result: {e!r}")))
+        async with lock:
+            writer.write(data)
+            await writer.drain()
+
+    async def _resolve(self, target: str):
+        if target in SERVICES:
+            return self.data[target]
+        kind, _, path = target.partition(":")
+        if kind != "db":
+            raise LookupError(f"unknown service {target}")
+        chats = self.data["chats"]
+        for attempt in range(2):
+            for db in chats.databases():
+                if db.path == path:
+                    return db
+            if attempt == 0:
+                # воркер мог увидеть новый чат раньше нас
+                await chats.reload()
+        raise LookupError(f"database {path} is not open")
+
+
+async def poll_raw(bot: Bot, pool: WorkerPool, allowed_updates: list[str], timeout: int = 30):
+    """Long polling без разбора апдейтов: сырой JSON сразу уходит воркерам."""
+    session = await bot.session.create_session()
+    url = bot.session.api.api_url(bot.token, "getUpdates")
+    offset = None
+    backoff = 1.0
+    while True:
+        params = {"timeout": timeout, "allowed_updates": json.dumps(allowed_updates)}
+        if offset is not None:
+            params["offset"] = offset
+        try:
+            async with session.post(
+                url, data=params, timeout=aiohttp.ClientTimeout(total=timeout + bot.session.timeout)
+            ) as resp:
+                payload = bot.session.json_loads(await resp.text())
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            log.warning("getUpdates failed: %r, retry in %.0f s", e, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+            continue
+
+        if not payload.get("ok"):
+            delay = (payload.get("parameters") or {}).get("retry_after") or backoff
+            log.warning("getUpdates: %s, retry in %s s", payload.get("description"), delay)
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, 30.0)
+            continue
+
+        backoff = 1.0
+        for update in payload["result"]:
+            if not isinstance(update, dict) or "update_id" not in update:
+                log.warning("skipping malformed update %r", update)
+                continue
+            offset = update["update_id"] + 1
+            await pool.put(update)
+
+
+async def run_workers(dp: Dispatcher, bot: Bot, config, data: dict):
+    """Главный процесс: воркеры + приём апдейтов, пока не упадёт один из воркеров."""
+    from webhook import run_webhook
+
+    pool = WorkerPool(data, config.workers)
+    try:
+        await pool.start()
+        if config.mode == "webhook":
+            receiving = asyncio.create_task(run_webhook(dp, bot, queue=pool, **data))
+        else:
+            await bot.delete_webhook(drop_pending_updates=config.drop_pending_updates)
+            receiving = asyncio.create_task(poll_raw(bot, pool, dp.resolve_used_update_types()))
+        failed = asyncio.create_task(pool.wait_failed())
+        try:
+            await asyncio.wait({receiving, failed}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for t in (receiving, failed):
+                t.cancel()
+            await asyncio.gather(receiving, failed, return_exceptions=True)
+        if failed.done() and not failed.cancelled():
+            raise RuntimeError("a worker process died")
+        receiving.result()
+    finally:
+        await pool.close()
+        await bot.session.close()
+
+
+# ====== воркер ======
+
+class RpcClient:
+    """Вызовы сервисов главного процесса; ответы приходят в любом порядке."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self._ids = itertools.count()
+        self._calls: dict[int, asyncio.Future] = {}
+        self._lock = asyncio.Lock()
+        self._reader_task = asyncio.create_task(self._read_replies())
+
+    async def call(self, target: str, method: str, args: tuple, kwargs: dict) -> Any:
+        call_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._calls[call_id] = fut
+        try:
+            data = _frame((call_id, target, method, args, kwargs))
+            async with self._lock:
+                self.writer.write(data)
+                await self.writer.drain()
+            return await fut
+        finally:
+            self._calls.pop(call_id, None)
+
+    async def _read_replies(self):
+        try:
+            while True:
+                call_id, ok, value = await _read(self.reader)
+                fut = self._calls.get(call_id)
+                if fut is None or fut.done():
+                    continue
+                if ok:
+                    fut.set_result(value)
+                else:
+                    fut.set_exception(value)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            for fut in self._calls.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError("lost connection to the main process"))
+
+    async def close(self):
+        self.writer.close()
+        self._reader_task.cancel()
+        await asyncio.gather(self._reader_task, return_exceptions=True)
+
+
+class RemoteService:
+    """Заместитель сервиса главного процесса: любой публичный метод — корутина-вызов по RPC."""
+
+    def __init__(self, rpc: RpcClient, target: str):
+        self._rpc = rpc
+        self._target = target
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        async def remote(*args, **kwargs):
+            return await self._rpc.call(self._target, name, args, kwargs)
+
+        remote.__name__ = name
+        return remote
+
+    async def close(self):
+        """Сервис закрывает главный процесс."""
+
+
+class RemoteDatabase(RemoteService):
+    """Database главного процесса по пути файла; init/close — ничего не делают."""
+
+    def __init__(self, rpc: RpcClient, path: str):
+        super().__init__(rpc, f"db:{path}")
+        self.path = path
+        self.chat_tz: dict[int, str] = {}
+
+    async def init(self):
+        pass
+
+
+async def _connect(port: int, token: bytes, role: bytes, index: int):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    hello = token + role + str(index).encode()
+    writer.write(len(hello).to_bytes(4, "big") + hello)
+    await writer.drain()
+    return reader, writer
+
+
+async def run_worker(index: int, port: int, token: bytes):
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.enums import ParseMode
+
+    from config import load_config
+    from main import build_dispatcher, close_services, open_services
+    from metrics import start_metrics_server
+    from runtime import make_session
+
+    config = load_config()
+    rpc = RpcClient(*await _connect(port, token, ROLE_RPC, index))
+    bot = Bot(
+        token=config.bot_token,
+        session=make_session(config),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+    data = await open_services(config, bot, rpc=rpc)
+    dp = build_dispatcher(data)
+
+    metrics_server = None
+    if config.metrics_port:
+        port_for_worker = config.metrics_port + 1 + index
+        metrics_server = await start_metrics_server(data["metrics"], config.metrics_host, port_for_worker)
+
+    # апдейты читаем, только когда есть свободное место: иначе главный процесс упрётся в drain
+    slots = asyncio.Semaphore(config.worker_concurrency)
+    tails: dict[tuple, asyncio.Task] = {}
+    running: set[asyncio.Task] = set()
+
+    async def handle(update: dict, previous: Optional[asyncio.Task]):
+        update_id = update.get("update_id")
+        try:
+            if previous is not None:
+                await asyncio.wait({previous})
+            await dp.feed_raw_update(bot, update, **data)
+        except Exception:
+            log.exception("update %s failed", update_id)
+        finally:
+            slots.release()
+
+    def forget(key: tuple, task: asyncio.Task):
+        running.discard(task)
+        if tails.get(key) is task:
+            del tails[key]
+
+    reader, writer = await _connect(port, token, ROLE_UPDATES, index)
+    await dp.emit_startup(bot=bot, **data)
+    log.info("worker %d started", index)
+    try:
+        while True:
+            await slots.acquire()
+            try:
+                update = await _read(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                slots.release()
+                break
+            # апдейты одного пользователя в чате — строго друг за другом
+            key = route_ids(update)
+            t = asyncio.create_task(handle(update, tails.get(key)))
+            tails[key] = t
+            running.add(t)
+            t.add_done_callback(lambda task, key=key: forget(key, task))
+
+        if running:
+            await asyncio.wait(running, timeout=10.0)
+    finally:
+        writer.close()
+        await dp.emit_shutdown(bot=bot, **data)
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        await close_services(data)
+        await bot.session.close()
+        await rpc.close()
+    log.info("worker %d stopped", index)
+
+
+def worker_main(index: int, port: int, token: bytes):
+    # Ctrl+C получает вся группа процессов; останавливает воркеров главный процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from config import load_config
+    from runtime import run
+
+    run(run_worker(index, port, token), load_config().runtime_profile)